@@ -1,102 +1,195 @@
+import asyncio
 from datetime import datetime
 import logging
-from typing import Literal, Optional
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage, filter_messages
+from typing import AsyncIterator, List, Literal, Optional
+from langchain.tools import BaseTool
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, RemoveMessage, SystemMessage, ToolCall, ToolMessage, filter_messages
 from app.ai.state import CustomState
 from app.message_formatter import FormattedMessage
 from app.model import GroupMessage
-from app.ai.tools import get_tools
-from app.config import config
+from app.ai.tools import get_tools, load_tools, stop_recheck
+from app.ai.context import build_context, compress_turn_tool_results, message_tokens
+from app.ai.tokens import count_tool_schema_tokens, get_encoding
+from app.ai.response_cache import response_cache
+from app.ai.router import choose_route, llm_router
+from app.ai.limiter import LLMLimiter, llm_limiter
+from app.ai.instrumentation import InstrumentedSqliteSaver, metrics_callback
+from app.metrics import NODE_SECONDS, group_label
+from app.tracing import current_callbacks, span
+from app.conversation_scheduler import conversation_scheduler
+from app.config import config, get_context_budget
 from langgraph.graph import StateGraph, END
 from langgraph.store.base import BaseStore
 from langgraph.prebuilt.tool_node import ToolNode
 from langchain_core.runnables import RunnableConfig
-from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from app.sql.client import db_client
 
 
 logger = logging.getLogger("uvicorn")
 
-def create_chat_model() -> ChatOpenAI:
-    """创建 ChatOpenAI 实例"""
-    return ChatOpenAI(
-        base_url=config.openai_base_url,
-        api_key=config.openai_api_key,
-        model=config.openai_model,
-        temperature=0,
-    )
-
 class CustomStore(BaseStore):
     pass
 
 
-def prepare_model_inputs(state: CustomState, config: RunnableConfig):
-    return [{"role": "system", "content": f"""
+SYSTEM_PROMPT = """
              你是一个AI助手,
              使用简短的结果回复,
              如果你不清楚答案,可以拒绝回复
              禁止回复无关问题,
              禁止使用markdown格式,
              请全程使用中文。
-             以下是你能利用的系统信息
-             当前时间：{state['today']}
-             """}] + state["messages"]
+             """
 
+SYSTEM_INFO_PROMPT = """以下是你能利用的系统信息
+             当前时间：{today}
+             """
 
-def create_agent(checkpointer: SqliteSaver):
-    llm = create_chat_model()
-    tools = get_tools()
-    bound_model = llm.bind_tools(tools)
 
-    model_runnable = prepare_model_inputs | bound_model
+def prepare_model_inputs(state: CustomState, history: List[BaseMessage], layout: str) -> List[BaseMessage]:
+    """按提示词布局拼接发送给模型的消息
 
-    def call_model(state: CustomState, config: RunnableConfig) -> CustomState:
-        summary = state.get("summary", "")
+    legacy: 当前时间写在系统提示词中，总结放在历史消息之前，每次请求的前缀都不同。
+    cached: 系统提示词不含任何变化的内容，和工具定义一起构成稳定的前缀；
+    总结和当前时间放在最新一轮对话之前，历史消息部分在下一轮仍能命中前缀缓存。
+    """
+    summary = state.get("summary", "")
+    info = SYSTEM_INFO_PROMPT.format(today=state["today"])
+    if layout == "legacy":
+        prefix = [SystemMessage(content=SYSTEM_PROMPT + info)]
         if summary:
-            system_message = f"以前对话的总结: {summary}"
-            state["messages"] = [SystemMessage(content=system_message)] + state["messages"]
-        response = model_runnable.invoke(state, config)
-        return {"messages": [response]}
+            prefix.append(SystemMessage(content=f"以前对话的总结: {summary}"))
+        return prefix + history
 
-    def summarize_conversation(state: CustomState):
-        summary = state.get("summary", "")
-        if summary:
-            summary_message = (
-                f"这是迄今为止的对话总结: {summary}\n\n"
-                "通过简短的方式使用新消息来扩展总结,不要总结实时信息(例如时间,天气),禁止使用问候语:"
-            )
-        else:
-            summary_message = "使用简短的方式总结以上对话,不要总结实时信息(例如时间,天气),禁止使用问候语:"
-
-        filtered_messages = []
-        skip_next_ai = False
-        for msg in state['messages']:
-            if isinstance(msg, HumanMessage):
-                continue
-            if isinstance(msg, ToolMessage):
-                skip_next_ai = True
-                continue
-            if isinstance(msg, AIMessage) and skip_next_ai:
-                skip_next_ai = False
-                continue
-            if isinstance(msg, AIMessage) and msg.tool_calls:
-                continue
-            filtered_messages.append(msg)
-
-        messages = filtered_messages + [HumanMessage(content=summary_message)]
-        response = llm.invoke(messages)
-        delete_messages = [RemoveMessage(id=m.id) for m in state["messages"][:-1]]
-        return {"summary": response.content, "messages": delete_messages}
+    if summary:
+        info = f"以前对话的总结: {summary}\n" + info
+    last_turn = max((i for i, m in enumerate(history) if isinstance(m, HumanMessage)), default=0)
+    return [SystemMessage(content=SYSTEM_PROMPT)] + history[:last_turn] + [SystemMessage(content=info)] + history[last_turn:]
+
+
+def log_token_usage(response: AIMessage, route: str, estimated: int, dropped: int):
+    """记录本轮提示词 token 用量，包括命中服务端前缀缓存的 token 数"""
+    usage = response.usage_metadata or {}
+    cached = (usage.get("input_token_details") or {}).get("cache_read")
+    if cached is None:
+        token_usage = response.response_metadata.get("token_usage") or {}
+        cached = (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    logger.info(
+        f"[{route}] 提示词token: 估算 {estimated}, 实际 {usage.get('input_tokens', '未知')}, "
+        f"缓存命中 {cached if cached is not None else '未知'}, "
+        f"输出 {usage.get('output_tokens', '未知')}, 裁剪消息 {dropped} 条"
+    )
+
+
+async def summarize_messages(
+    llm: BaseChatModel,
+    summary: str,
+    messages: List[BaseMessage],
+    key=None,
+    run_config: Optional[RunnableConfig] = None
+) -> str:
+    """将对话扩展到已有总结中，返回新的总结
+
+    key 为请求限流时所属的分组，run_config 用于传递回调
+    """
+    if summary:
+        summary_message = (
+            f"这是迄今为止的对话总结: {summary}\n\n"
+            "通过简短的方式使用新消息来扩展总结,不要总结实时信息(例如时间,天气),禁止使用问候语:"
+        )
+    else:
+        summary_message = "使用简短的方式总结以上对话,不要总结实时信息(例如时间,天气),禁止使用问候语:"
 
+    filtered_messages = []
+    skip_next_ai = False
+    for msg in messages:
+        if isinstance(msg, HumanMessage):
+            continue
+        if isinstance(msg, ToolMessage):
+            skip_next_ai = True
+            continue
+        if isinstance(msg, AIMessage) and skip_next_ai:
+            skip_next_ai = False
+            continue
+        if isinstance(msg, AIMessage) and msg.tool_calls:
+            continue
+        filtered_messages.append(msg)
+
+    inputs = filtered_messages + [HumanMessage(content=summary_message)]
+    tokens = sum(message_tokens(m, config.openai_model) for m in inputs)
+    response = await llm_limiter.ainvoke(llm, inputs, run_config, key=key, tokens=tokens)
+    return response.content
+
+
+def turn_tool_calls(messages: List[BaseMessage]) -> List[ToolCall]:
+    """最后一轮对话中的工具调用"""
+    calls = []
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, AIMessage):
+            calls.extend(message.tool_calls)
+    return calls
+
+
+def create_agent(
+    checkpointer: BaseCheckpointSaver,
+    llm: Optional[BaseChatModel] = None,
+    tools: Optional[List[BaseTool]] = None,
+    debug: bool = False,
+    fast_llm: Optional[BaseChatModel] = None,
+    limiter: Optional[LLMLimiter] = None
+):
+    """创建 agent
+
+    Args:
+        llm: main 路由的模型，回复需要调用工具的对话
+        fast_llm: fast 路由的模型，回复简短的消息，为空时全部使用 llm
+        debug: 打印图每一步的调试输出，开销较大，只用于本地排查问题
+        limiter: 模型请求的限流器，为空时使用全局的 llm_limiter
+    """
+    llm = llm or llm_router.get_model("main")
+    limiter = limiter or llm_limiter
+    tools = get_tools() if tools is None else tools
+    tool_result_max_chars = config.tool_result_max_chars
+    prompt_layout = config.prompt_layout
+    fast_max_chars = config.llm_fast_max_chars if fast_llm is not None and fast_llm is not llm else 0
+
+    routes = {}
+    for route, model in (("main", llm), ("fast", fast_llm or llm)):
+        model_name = getattr(model, "model_name", None) or config.openai_model
+        bound_model = model.bind_tools(tools)
+        # 工具定义随每次请求发送，预先计算其 token 数
+        tool_tokens = count_tool_schema_tokens(getattr(bound_model, "kwargs", {}).get("tools"), model_name)
+        routes[route] = (bound_model, model_name, get_context_budget(model_name), tool_tokens)
+
+    async def call_model(state: CustomState, config: RunnableConfig) -> CustomState:
+        route = choose_route(state["messages"], fast_max_chars)
+        bound_model, model_name, budget, tool_tokens = routes[route]
+        # 先用空历史拼出系统提示词、总结和时间，加上工具定义，计算需要预留的 token
+        reserved = tool_tokens + sum(message_tokens(m, model_name) for m in prepare_model_inputs(state, [], prompt_layout))
+        messages, history_tokens = build_context(state["messages"], model_name, budget - reserved)
+        configurable = config.get("configurable", {})
+        response = await limiter.ainvoke(
+            bound_model,
+            prepare_model_inputs(state, messages, prompt_layout),
+            config,
+            # 按群分配请求名额，私聊各自为一组
+            key=configurable.get("group_id") or configurable.get("thread_id"),
+            tokens=reserved + history_tokens
+        )
+        log_token_usage(response, route, reserved + history_tokens, len(state["messages"]) - len(messages))
+        if response.tool_calls:
+            return {"messages": [response]}
+        # 本轮结束，截断本轮的工具结果并按 id 替换检查点中的原消息，之后的轮次不再改动
+        return {"messages": [*compress_turn_tool_results(state["messages"], tool_result_max_chars), response]}
 
     def should_continue(state: CustomState) -> Literal["tools", "__end__"]:
         messages = state["messages"]
         last_message = messages[-1]
 
         if not isinstance(last_message, AIMessage) or not last_message.tool_calls:
-            if len(messages) > 6:
-                return "summarize"
             return "__end__"
         else:
             state["has_tool_call"] = True
@@ -106,13 +199,11 @@ def create_agent(checkpointer: SqliteSaver):
     workflow = StateGraph(CustomState)
     workflow.set_entry_point("agent")
     workflow.add_node("agent", call_model)
-    workflow.add_node("summarize", summarize_conversation)
     workflow.add_node("tools", tool_nodes)
     workflow.add_edge("tools", "agent")
-    workflow.add_conditional_edges("agent", should_continue, ['summarize', 'tools', END])
-    workflow.set_finish_point('summarize')
+    workflow.add_conditional_edges("agent", should_continue, ['tools', END])
     return workflow.compile(
-        debug=True,
+        debug=debug,
         checkpointer=checkpointer
     )
 
@@ -129,24 +220,202 @@ class AIHandler:
     def __init__(self):
         # 确保初始化代码只运行一次
         if not AIHandler._initialized:
-            checkpointer = SqliteSaver(db_client.get_conn())
-            self.agent_executor = create_agent(checkpointer)
+            # agent 需要在事件循环中检查工具可用性、创建异步检查点后再构建
+            self.agent_executor = None
+            self.llm = None
+            self.fast_llm = None
+            self._conn = None
+            self._checkpointer = None
+            # 构建 agent 时绑定的工具列表，工具可用性变化后重新构建
+            self._tools = None
+            # 后台总结任务，保存引用避免被回收
+            self._summary_tasks = set()
+            self._setup_lock = asyncio.Lock()
             AIHandler._initialized = True
 
-    def get_response(self, message: FormattedMessage) -> Optional[str]:
-        """获取AI响应"""
+    async def setup(self):
+        """创建异步检查点和agent，重复调用时直接返回已创建的agent，可用工具变化时重新构建"""
+        # 初始化完成后每次请求只比较工具列表，不加锁
+        if self.agent_executor is not None and get_tools() is self._tools:
+            return self.agent_executor
+        async with self._setup_lock:
+            tools = await load_tools()
+            if self._conn is None:
+                # tiktoken 首次使用时会下载编码文件，提前在线程中加载
+                await asyncio.to_thread(get_encoding, config.openai_model)
+                self._conn = await db_client.get_async_conn()
+                self._checkpointer = InstrumentedSqliteSaver(self._conn)
+                self.llm = llm_router.get_model("main")
+                self.fast_llm = llm_router.get_model("fast")
+            if self.agent_executor is None or tools is not self._tools:
+                if self.agent_executor is not None:
+                    logger.info(f"可用工具变化，重新构建agent: {[t.name for t in tools]}")
+                self._tools = tools
+                self.agent_executor = create_agent(
+                    self._checkpointer, llm=self.llm, tools=tools, debug=config.graph_debug, fast_llm=self.fast_llm
+                )
+        return self.agent_executor
+
+    def warm_up(self) -> asyncio.Task:
+        """在后台初始化agent，不阻塞服务启动"""
+        def log_error(task: asyncio.Task):
+            if not task.cancelled() and task.exception():
+                logger.error(f"AI初始化失败: {task.exception()}")
+
+        task = asyncio.create_task(self.setup())
+        task.add_done_callback(log_error)
+        return task
+
+    async def close(self):
+        """等待后台总结完成并关闭检查点连接"""
+        await stop_recheck()
+        if self._summary_tasks:
+            await asyncio.gather(*self._summary_tasks, return_exceptions=True)
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+            self._checkpointer = None
+            self.agent_executor = None
+
+    def _build_request(self, message: FormattedMessage, content: Optional[str]):
+        """构建 agent 的输入和运行配置"""
+        group_id = message.raw.group_id if isinstance(message.raw, GroupMessage) else None
+        return (
+            {"messages": [HumanMessage(content=content or message.content)], "today": datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
+            {
+                "configurable": {"thread_id": message.thread_id, "user_id": message.raw.user_id, "group_id": group_id},
+                "callbacks": [metrics_callback, *current_callbacks()]
+            }
+        )
+
+    async def get_response(self, message: FormattedMessage, content: Optional[str] = None) -> Optional[str]:
+        """获取AI响应
+
+        Args:
+            message: 格式化后的消息
+            content: 替代 message.content 作为用户输入，用于合并多条消息
+        """
         try:
-            thread_id = str(message.raw.user_id) + ('-' + str(message.raw.group_id)) if isinstance(message.raw, GroupMessage) else ''
+            agent_executor = await self.setup()
+            input, run_config = self._build_request(message, content)
+            cached = await self._get_cached_response(input, run_config)
+            if cached is not None:
+                self.schedule_summary(message.thread_id, run_config)
+                return cached
+            response = await agent_executor.ainvoke(input=input, config=run_config)
+            self.schedule_summary(message.thread_id, run_config)
+            answer = response["messages"][-1].content
+            await self._cache_response(input, answer, turn_tool_calls(response["messages"]))
+            return answer
+        except Exception as e:
+            logger.info(f"AI处理出错: {e}")
+            raise e
 
-            response = self.agent_executor.invoke(
-                input={"messages": [HumanMessage(content=message.content)], "today": datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
-                config={"configurable": {"thread_id": thread_id, "user_id": message.raw.user_id, "group_id": message.raw.group_id if isinstance(message.raw, GroupMessage) else None}}
-            )
-            return response["messages"][-1].content
+    async def stream_response(self, message: FormattedMessage, content: Optional[str] = None) -> AsyncIterator[str]:
+        """流式获取AI响应，逐个产出 agent 节点生成的文本片段
+
+        Args:
+            message: 格式化后的消息
+            content: 替代 message.content 作为用户输入，用于合并多条消息
+        """
+        try:
+            agent_executor = await self.setup()
+            input, run_config = self._build_request(message, content)
+            cached = await self._get_cached_response(input, run_config)
+            if cached is not None:
+                self.schedule_summary(message.thread_id, run_config)
+                yield cached
+                return
+            # parts 只保存最后一次模型请求的文本，调用工具前输出的文本不作为回答缓存
+            parts = []
+            # 不支持流式输出的模型（如不流式的备用模型）只会产出完整的 AIMessage
+            final: Optional[AIMessage] = None
+            async for chunk, metadata in agent_executor.astream(input=input, config=run_config, stream_mode="messages"):
+                if isinstance(chunk, ToolMessage):
+                    parts = []
+                    continue
+                # 只输出回复文本，跳过工具调用、工具结果和总结节点的输出
+                if metadata.get("langgraph_node") != "agent" or not isinstance(chunk, AIMessage):
+                    continue
+                if not isinstance(chunk, AIMessageChunk):
+                    if not chunk.tool_calls:
+                        final = chunk
+                    continue
+                if chunk.tool_call_chunks or not isinstance(chunk.content, str) or not chunk.content:
+                    continue
+                parts.append(chunk.content)
+                yield chunk.content
+            if not parts and final is not None and isinstance(final.content, str) and final.content:
+                parts.append(final.content)
+                yield final.content
+            self.schedule_summary(message.thread_id, run_config)
+            if config.response_cache_enabled and parts:
+                # 流式输出中只有工具调用的片段，从检查点读取完整的工具调用参数
+                state = await agent_executor.aget_state(run_config)
+                await self._cache_response(input, "".join(parts), turn_tool_calls(state.values["messages"]))
         except Exception as e:
             logger.info(f"AI处理出错: {e}")
             raise e
 
+    async def _get_cached_response(self, input: dict, run_config: RunnableConfig) -> Optional[str]:
+        """查找缓存的回复，命中时把本轮问答写入检查点，保持对话历史完整"""
+        if not config.response_cache_enabled:
+            return None
+        question = input["messages"][0]
+        with span("response_cache.get"):
+            answer = await response_cache.get(question.content)
+        if answer is not None:
+            logger.info(f"回复缓存命中: {question.content}")
+            await self.agent_executor.aupdate_state(
+                run_config,
+                {"messages": [question, AIMessage(content=answer)]},
+                as_node="agent"
+            )
+        return answer
+
+    async def _cache_response(self, input: dict, answer: str, tool_calls: List[ToolCall]):
+        if config.response_cache_enabled:
+            await response_cache.put(input["messages"][0].content, answer, tool_calls)
+
+    def schedule_summary(self, thread_id: str, run_config: RunnableConfig):
+        """在后台检查并总结对话
+
+        任务排在该会话的调度队列中，会在当前回复发送完成、释放会话后才执行，
+        不会增加本次回复的延迟，也不会与同一会话的下一轮对话并发修改检查点。
+        """
+        async def run():
+            async with conversation_scheduler.serialize(thread_id):
+                await self.summarize_if_needed(run_config)
+
+        task = asyncio.create_task(run())
+        self._summary_tasks.add(task)
+        task.add_done_callback(self._summary_tasks.discard)
+
+    async def summarize_if_needed(self, run_config: RunnableConfig):
+        """对话 token 数超过阈值时生成总结，并从检查点中删除已总结的消息"""
+        try:
+            state = await self.agent_executor.aget_state(run_config)
+            messages = state.values.get("messages", [])
+            tokens = sum(message_tokens(m, config.openai_model) for m in messages)
+            if tokens <= config.summary_token_threshold:
+                return
+            group_id = run_config["configurable"].get("group_id")
+            with NODE_SECONDS.time("summarize", group_label(group_id)):
+                summary = await summarize_messages(
+                    self.fast_llm,
+                    state.values.get("summary", ""),
+                    messages,
+                    key=group_id or run_config["configurable"]["thread_id"],
+                    run_config=run_config
+                )
+            await self.agent_executor.aupdate_state(
+                run_config,
+                {"summary": summary, "messages": [RemoveMessage(id=m.id) for m in messages[:-1]]},
+                as_node="agent"
+            )
+        except Exception as e:
+            logger.error(f"总结对话失败: {str(e)}")
+
     @classmethod
     def get_instance(cls) -> 'AIHandler':
         """获取AIHandler实例"""
@@ -0,0 +1,86 @@
+from typing import List, Sequence, Tuple
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+from app.ai.tokens import count_message_tokens, get_encoding
+
+# token 数缓存在消息的 response_metadata 中，随检查点一起保存，不会发送给模型
+# 按编码名称分别缓存 {编码: token数}，不同路由的模型、总结使用的模型编码可能不同
+TOKEN_COUNT_KEY = "token_count"
+# 编码加载失败、按字符数估算时使用的键
+ESTIMATE_KEY = "chars"
+
+def message_tokens(message: BaseMessage, model: str) -> int:
+    """获取消息在模型编码下的 token 数，首次计算后缓存在消息上"""
+    encoding = get_encoding(model)
+    key = encoding.name if encoding is not None else ESTIMATE_KEY
+    counts = message.response_metadata.get(TOKEN_COUNT_KEY)
+    if not isinstance(counts, dict):
+        # 旧版本缓存的是不区分编码的整数，重新计算
+        counts = message.response_metadata[TOKEN_COUNT_KEY] = {}
+    count = counts.get(key)
+    if count is None:
+        count = counts[key] = count_message_tokens(message, model)
+    return count
+
+def _compress_tool_message(message: ToolMessage, max_chars: int) -> ToolMessage:
+    """截断过长的工具结果，返回新的消息对象"""
+    if not isinstance(message.content, str) or len(message.content) <= max_chars:
+        return message
+    metadata = {k: v for k, v in message.response_metadata.items() if k != TOKEN_COUNT_KEY}
+    return message.model_copy(update={
+        "content": message.content[:max_chars] + "…(已截断)",
+        "response_metadata": metadata
+    })
+
+def compress_turn_tool_results(messages: Sequence[BaseMessage], max_chars: int) -> List[ToolMessage]:
+    """截断最近一轮中过长的工具结果（例如7天天气预报）
+
+    在一轮对话结束时调用，返回的消息与原消息 id 相同，写回状态后替换检查点中的原消息，
+    检查点中不再保留完整的工具结果。每条工具结果只截断这一次，之后的轮次发送给模型的历史消息保持不变，
+    能够命中服务端的前缀缓存。
+    """
+    compressed = []
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, ToolMessage):
+            short = _compress_tool_message(message, max_chars)
+            if short is not message:
+                compressed.append(short)
+    return compressed[::-1]
+
+def _split_turns(messages: Sequence[BaseMessage]) -> List[List[BaseMessage]]:
+    """按用户消息切分为轮次，保证工具调用和工具结果在同一轮内"""
+    turns: List[List[BaseMessage]] = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+def build_context(
+    messages: Sequence[BaseMessage],
+    model: str,
+    budget: int
+) -> Tuple[List[BaseMessage], int]:
+    """在 token 预算内构建发送给模型的历史消息
+
+    超出预算时按轮次从最旧的开始丢弃，最近一轮始终保留。
+    不修改保留的消息，工具结果已在所属轮次结束时截断（见 compress_turn_tool_results）。
+
+    Args:
+        messages: 检查点中的历史消息
+        model: 用于计算 token 的模型名称
+        budget: 历史消息可用的 token 数（已扣除系统提示词和工具定义）
+
+    Returns:
+        Tuple[List[BaseMessage], int]: 裁剪后的消息和其 token 数
+    """
+    turns = _split_turns(messages)
+    turn_tokens = [sum(message_tokens(m, model) for m in turn) for turn in turns]
+    total = sum(turn_tokens)
+    start = 0
+    while total > budget and start < len(turns) - 1:
+        total -= turn_tokens[start]
+        start += 1
+
+    return [message for turn in turns[start:] for message in turn], total
@@ -0,0 +1,102 @@
+import time
+from typing import Any, Dict, Optional, Tuple
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from app.metrics import (
+    CHECKPOINT_SECONDS, LLM_TOKENS_TOTAL, NODE_SECONDS, TOOL_ERRORS_TOTAL, TOOL_SECONDS, group_label,
+)
+from app.tracing import span
+
+
+def _metadata_group(metadata: Optional[Dict[str, Any]]) -> str:
+    # LangGraph 会把 configurable 中的标量值复制到 metadata，私聊的 group_id 为 None 不会出现
+    return group_label((metadata or {}).get("group_id"))
+
+
+def _config_group(config: Optional[RunnableConfig]) -> str:
+    return group_label(((config or {}).get("configurable") or {}).get("group_id"))
+
+
+class MetricsCallback(BaseCallbackHandler):
+    """统计图节点、工具调用的耗时和模型请求的 token 数"""
+    run_inline = True
+
+    def __init__(self):
+        # run_id -> (开始时间, 节点/工具/模型名, 群组标签)
+        self._runs: Dict[UUID, Tuple[float, str, str]] = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, metadata: Optional[Dict[str, Any]] = None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # 节点内部的子调用（如条件边）也带有 langgraph_node，只统计节点本身，跳过 __start__ 等内部节点
+        if node and kwargs.get("name") == node and not node.startswith("__"):
+            self._runs[run_id] = (time.perf_counter(), node, _metadata_group(metadata))
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs):
+        self._finish(run_id, NODE_SECONDS)
+
+    def on_chain_error(self, error, *, run_id: UUID, **kwargs):
+        self._finish(run_id, NODE_SECONDS)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, metadata: Optional[Dict[str, Any]] = None, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "unknown"
+        self._runs[run_id] = (time.perf_counter(), name, _metadata_group(metadata))
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs):
+        self._finish(run_id, TOOL_SECONDS)
+
+    def on_tool_error(self, error, *, run_id: UUID, **kwargs):
+        run = self._finish(run_id, TOOL_SECONDS)
+        if run is not None:
+            TOOL_ERRORS_TOTAL.inc(run[1], run[2])
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata: Optional[Dict[str, Any]] = None, **kwargs):
+        model = (metadata or {}).get("ls_model_name") or "unknown"
+        self._runs[run_id] = (time.perf_counter(), model, _metadata_group(metadata))
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        _, model, group = run
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if not usage:
+                    continue
+                LLM_TOKENS_TOTAL.inc(model, "input", group, amount=usage.get("input_tokens", 0))
+                LLM_TOKENS_TOTAL.inc(model, "output", group, amount=usage.get("output_tokens", 0))
+                cached = (usage.get("input_token_details") or {}).get("cache_read")
+                if cached:
+                    LLM_TOKENS_TOTAL.inc(model, "cached", group, amount=cached)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        self._runs.pop(run_id, None)
+
+    def _finish(self, run_id: UUID, histogram) -> Optional[Tuple[float, str, str]]:
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            started, name, group = run
+            histogram.observe(time.perf_counter() - started, name, group)
+        return run
+
+
+class InstrumentedSqliteSaver(AsyncSqliteSaver):
+    """统计检查点读写耗时的 AsyncSqliteSaver，同时记录到当前对话的追踪中"""
+
+    async def aget_tuple(self, config: RunnableConfig):
+        with CHECKPOINT_SECONDS.time("get", _config_group(config)), span("checkpoint.get"):
+            return await super().aget_tuple(config)
+
+    async def aput(self, config: RunnableConfig, checkpoint, metadata, new_versions) -> RunnableConfig:
+        with CHECKPOINT_SECONDS.time("put", _config_group(config)), span("checkpoint.put"):
+            return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes, task_id: str) -> None:
+        with CHECKPOINT_SECONDS.time("put_writes", _config_group(config)), span("checkpoint.put_writes"):
+            return await super().aput_writes(config, writes, task_id)
+
+
+# 创建全局实例
+metrics_callback = MetricsCallback()
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Hashable, Optional
+import openai
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import merge_configs
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+from app.config import config
+from app.ratelimit import TokenBucket
+from app.tracing import record
+
+logger = logging.getLogger("uvicorn")
+
+# 预估的单次回复 token 数，与提示词 token 一起计入每分钟 token 限额
+EXPECTED_OUTPUT_TOKENS = 256
+
+# 令牌桶最多积累 10 秒的额度，避免空闲后一次性打满每分钟的限额
+BURST_SECONDS = 10
+
+
+def is_retryable(error: BaseException) -> bool:
+    """限流、超时、连接失败和服务端错误可以重试"""
+    return isinstance(error, (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    ))
+
+
+class OutputStarted(BaseCallbackHandler):
+    """记录流式请求是否已经输出了文本"""
+    run_inline = True
+
+    def __init__(self):
+        self.started = False
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if token:
+            self.started = True
+
+
+class FairSemaphore:
+    """按分组轮转的信号量
+
+    没有空闲名额时，等待者按分组排队，释放名额时依次轮到下一个分组的第一个等待者，
+    消息多的群只会排长自己的队，不会让其他群一直等待。
+    """
+    def __init__(self, limit: int):
+        self._available = limit
+        self._waiters: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+
+    async def acquire(self, key: Hashable):
+        if self._available > 0 and not self._waiters:
+            self._available -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已经分到名额后才被取消，转交给下一个等待者
+                self.release()
+            else:
+                queue = self._waiters.get(key)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del self._waiters[key]
+            raise
+
+    def release(self):
+        while self._waiters:
+            key, queue = next(iter(self._waiters.items()))
+            future = queue.popleft()
+            # 该分组还有等待者时排到队尾，轮到其他分组
+            if queue:
+                self._waiters.move_to_end(key)
+            else:
+                del self._waiters[key]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._available += 1
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+
+
+class LLMLimiter:
+    """模型请求的客户端限流
+
+    限制同时进行的请求数、每分钟请求数和每分钟 token 数，
+    限流、超时等可重试的错误按带随机抖动的指数退避重试，退避期间不占用名额；
+    流式输出已经开始后的错误不重试。
+    """
+    def __init__(self, max_concurrency: int, rpm: int, tpm: int, max_attempts: int, max_wait: float):
+        self.semaphore = FairSemaphore(max_concurrency)
+        self.request_bucket = TokenBucket(rpm / 60, max(1, rpm / 60 * BURST_SECONDS)) if rpm > 0 else None
+        self.token_bucket = TokenBucket(tpm / 60, max(1, tpm / 60 * BURST_SECONDS)) if tpm > 0 else None
+        self.max_attempts = max_attempts
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.retries = 0
+
+    @asynccontextmanager
+    async def slot(self, key: Hashable, tokens: int):
+        """获取一个请求名额
+
+        Args:
+            key: 公平分配名额的分组，通常是群号
+            tokens: 预估的本次请求 token 数
+        """
+        started = time.perf_counter()
+        await self.semaphore.acquire(key)
+        try:
+            if self.request_bucket:
+                await self.request_bucket.acquire()
+            if self.token_bucket:
+                await self.token_bucket.acquire(tokens + EXPECTED_OUTPUT_TOKENS)
+            record("llm.wait", started)
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+        finally:
+            self.semaphore.release()
+
+    async def ainvoke(
+        self,
+        runnable: Runnable,
+        input: Any,
+        run_config: Optional[RunnableConfig] = None,
+        key: Hashable = None,
+        tokens: int = 0
+    ) -> Any:
+        """在限流下调用模型，可重试的错误自动重试
+
+        流式输出时，已经输出文本后出错不再重试，否则重试的回复会接在已发送的部分后面重复输出。
+        """
+        output = OutputStarted()
+        run_config = merge_configs(run_config, {"callbacks": [output]})
+        async for attempt in AsyncRetrying(
+            retry=retry_if_exception(lambda error: not output.started and is_retryable(error)),
+            wait=wait_random_exponential(multiplier=1, max=self.max_wait),
+            stop=stop_after_attempt(self.max_attempts),
+            before_sleep=self._log_retry,
+            reraise=True,
+        ):
+            with attempt:
+                async with self.slot(key, tokens):
+                    return await runnable.ainvoke(input, run_config)
+
+    def _log_retry(self, retry_state):
+        self.retries += 1
+        logger.warning(
+            f"模型请求失败，{retry_state.next_action.sleep:.1f} 秒后第 {retry_state.attempt_number} 次重试: "
+            f"{retry_state.outcome.exception()}"
+        )
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.semaphore.waiting,
+            "retries": self.retries,
+        }
+
+
+# 创建全局实例
+llm_limiter = LLMLimiter(
+    max_concurrency=config.llm_max_concurrency,
+    rpm=config.llm_rpm,
+    tpm=config.llm_tpm,
+    max_attempts=config.llm_max_attempts,
+    max_wait=config.llm_retry_max_wait
+)
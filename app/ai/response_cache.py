@@ -0,0 +1,177 @@
+import logging
+import re
+import unicodedata
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+from app.cache import TTLCache
+from app.config import config
+
+logger = logging.getLogger("uvicorn")
+
+# 询问当前时间、指代之前的对话或提问者本人的问题不走缓存
+# 只匹配明确的短语，“我”“这个”“现在”等常见字词出现在大多数问题中，不能作为依据
+BYPASS_PATTERN = re.compile(
+    r"几点|什么时间|现在时间|星期几|礼拜几|周几|几号|今天日期|"
+    r"刚才|刚刚|之前说|之前问|上次|上面|前面说|你记得|你还记得|"
+    r"我叫什么|我是谁|我的名字|"
+    r"提醒|定时|闹钟"
+)
+
+
+def normalize_question(text: str) -> str:
+    """统一全角半角和大小写，去掉空白和标点"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(
+        ch for ch in text
+        if not ch.isspace() and not unicodedata.category(ch).startswith("P")
+    )
+
+
+class ResponseCache:
+    """跨用户、群组共享的回复缓存
+
+    以规范化后的问题文本加当天日期为键精确匹配；配置了嵌入模型时，
+    精确匹配未命中后再用余弦相似度在内存中查找相似的问题。
+    条目按 TTL 过期，超过容量时按 LRU 淘汰。
+    """
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        cacheable_tools: Iterable[str] = (),
+        embeddings: Optional[Embeddings] = None,
+        similarity: float = 0.92
+    ):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.cacheable_tools = set(cacheable_tools)
+        self.embeddings = embeddings
+        self.similarity = similarity
+        # 相似度索引：每行是一个已归一化的问题向量，与 _keys 一一对应
+        self._keys: List[str] = []
+        self._vectors: Optional[np.ndarray] = None
+        # get 时计算的问题向量，put 时复用，避免重复请求嵌入接口
+        self._pending_vectors = TTLCache(maxsize=256, ttl=60)
+        self.similar_hits = 0
+
+    @staticmethod
+    def cache_key(text: str) -> Optional[str]:
+        """生成缓存键，问题不可缓存时返回 None"""
+        if not text or BYPASS_PATTERN.search(text):
+            return None
+        question = normalize_question(text)
+        if not question:
+            return None
+        return f"{date.today():%Y-%m-%d}|{question}"
+
+    async def get(self, text: str) -> Optional[str]:
+        """查找缓存的回复，未命中时返回 None"""
+        key = self.cache_key(text)
+        if key is None:
+            return None
+        answer = self._cache.get(key)
+        if answer is not None or self.embeddings is None or self._vectors is None:
+            return answer
+
+        vector = await self._embed(key)
+        if vector is None:
+            return None
+        self._pending_vectors.set(key, vector)
+        today = key.split("|", 1)[0]
+        scores = self._vectors @ vector
+        for index in np.argsort(scores)[::-1]:
+            if scores[index] < self.similarity:
+                break
+            similar_key = self._keys[index]
+            if not similar_key.startswith(today):
+                continue
+            answer = self._cache.get(similar_key)
+            if answer is not None:
+                self.similar_hits += 1
+                return answer
+        return None
+
+    def is_self_contained(self, text: str, tool_calls: Iterable[Dict[str, Any]]) -> bool:
+        """回复是否只依赖问题本身，可以提供给其他会话
+
+        缓存在所有用户、群组间共享，“为什么”“那明天呢”这类追问的回答依赖各自的对话上下文。
+        只有调用了可缓存的工具、且每次调用的字符串参数（如城市名）都出现在问题中时，
+        才认为问题已经包含了回答所需的全部信息；没有调用工具的回复无法判断，不缓存。
+        """
+        calls = list(tool_calls)
+        if not calls:
+            return False
+        question = normalize_question(text)
+        for call in calls:
+            if call["name"] not in self.cacheable_tools:
+                return False
+            values = [normalize_question(v) for v in call["args"].values() if isinstance(v, str)]
+            if not values or not all(value and value in question for value in values):
+                return False
+        return True
+
+    async def put(self, text: str, answer: str, tool_calls: Iterable[Dict[str, Any]] = ()):
+        """缓存回复，问题依赖对话上下文时跳过（见 is_self_contained）"""
+        key = self.cache_key(text)
+        if key is None or not answer or not self.is_self_contained(text, tool_calls):
+            return
+        self._cache.set(key, answer)
+        if self.embeddings is None:
+            return
+
+        vector = self._pending_vectors.pop(key)
+        if vector is None:
+            vector = await self._embed(key)
+            if vector is None:
+                return
+        self._add_vector(key, vector)
+
+    def _add_vector(self, key: str, vector: np.ndarray):
+        if self._vectors is None:
+            self._keys, self._vectors = [key], vector[np.newaxis, :]
+        else:
+            self._keys.append(key)
+            self._vectors = np.vstack([self._vectors, vector])
+        # 索引中过期、被淘汰的条目超过一半时重建
+        if len(self._keys) > 2 * self._cache.maxsize:
+            alive = [i for i, k in enumerate(self._keys) if k in self._cache]
+            self._keys = [self._keys[i] for i in alive]
+            self._vectors = self._vectors[alive] if alive else None
+
+    async def _embed(self, key: str) -> Optional[np.ndarray]:
+        """计算问题的归一化向量，失败时返回 None 退化为精确匹配"""
+        try:
+            vector = np.asarray(await self.embeddings.aembed_query(key.split("|", 1)[1]), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"计算问题向量失败: {str(e)}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def stats(self):
+        return {**self._cache.stats(), "similar_hits": self.similar_hits}
+
+
+def create_embeddings() -> Optional[Embeddings]:
+    """创建相似问题匹配使用的嵌入模型，未配置时返回 None"""
+    if not config.response_cache_embedding_model:
+        return None
+    return OpenAIEmbeddings(
+        base_url=config.openai_base_url,
+        api_key=config.openai_api_key,
+        model=config.response_cache_embedding_model,
+        # 问题很短，不需要按 token 切分（切分依赖 tiktoken 在线下载编码）
+        check_embedding_ctx_length=False
+    )
+
+
+# 创建全局实例
+response_cache = ResponseCache(
+    maxsize=config.response_cache_maxsize,
+    ttl=config.response_cache_ttl,
+    cacheable_tools=config.response_cache_tools,
+    embeddings=create_embeddings() if config.response_cache_enabled else None,
+    similarity=config.response_cache_similarity
+)
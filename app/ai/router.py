@@ -0,0 +1,133 @@
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Literal, Optional
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, HumanMessage
+from langchain_openai import ChatOpenAI
+from app.config import LLMEndpoint, config
+from app.stats import percentile
+
+logger = logging.getLogger("uvicorn")
+
+Route = Literal["main", "fast"]
+
+
+class RouteStats:
+    """单个模型地址的调用统计"""
+    def __init__(self, window: int = 1024):
+        self.calls = 0
+        self.failures = 0
+        # 最近的请求耗时，用于计算分位数
+        self.recent_latencies: Deque[float] = deque(maxlen=window)
+
+    def record(self, latency: float, ok: bool):
+        self.calls += 1
+        if not ok:
+            self.failures += 1
+        self.recent_latencies.append(latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies: List[float] = sorted(self.recent_latencies)
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "latency_p99": percentile(latencies, 99),
+        }
+
+
+class LatencyCallback(BaseCallbackHandler):
+    """记录每次模型请求的耗时和是否失败"""
+    run_inline = True
+
+    def __init__(self, stats: RouteStats):
+        self.stats = stats
+        self._started: Dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        self._finish(run_id, True)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        self._finish(run_id, False)
+
+    def _finish(self, run_id: UUID, ok: bool):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            self.stats.record(time.perf_counter() - started, ok)
+
+
+def create_chat_model(endpoint: LLMEndpoint, callbacks: Optional[list] = None) -> ChatOpenAI:
+    """创建 ChatOpenAI 实例"""
+    return ChatOpenAI(
+        base_url=endpoint.base_url,
+        api_key=endpoint.api_key,
+        model=endpoint.model,
+        timeout=endpoint.timeout,
+        temperature=0,
+        # 重试由 llm_limiter 统一处理，失败时先切换到下一个地址
+        max_retries=0,
+        # 流式请求默认不返回用量，不开启时 token 统计和追踪中的 token 数都为 0
+        stream_usage=True,
+        callbacks=callbacks,
+    )
+
+
+def choose_route(messages: List[BaseMessage], fast_max_chars: int) -> Route:
+    """选择回复本次请求的路由
+
+    简短的新消息交给 fast 路由；已经调用过工具、需要根据工具结果组织回复的请求交给 main 路由。
+    """
+    last = messages[-1] if messages else None
+    if isinstance(last, HumanMessage) and isinstance(last.content, str) and len(last.content) <= fast_max_chars:
+        return "fast"
+    return "main"
+
+
+class LLMRouter:
+    """按路由管理模型，每个路由内的多个地址按顺序故障转移"""
+    def __init__(self, routes: Dict[str, List[LLMEndpoint]]):
+        self.routes = routes
+        self.stats: Dict[str, RouteStats] = {}
+        self._models: Dict[str, BaseChatModel] = {}
+
+    def get_endpoints(self, route: Route) -> List[LLMEndpoint]:
+        """路由配置的模型地址，未配置 main 时使用 [openai]，未配置 fast 时使用 main"""
+        endpoints = self.routes.get(route)
+        if endpoints:
+            return endpoints
+        if route == "fast":
+            return self.get_endpoints("main")
+        return [LLMEndpoint(base_url=config.openai_base_url, api_key=config.openai_api_key, model=config.openai_model)]
+
+    def get_model(self, route: Route) -> BaseChatModel:
+        """获取路由的模型，相同的地址配置共享同一个模型实例"""
+        endpoints = self.get_endpoints(route)
+        key = repr(endpoints)
+        if key not in self._models:
+            models = []
+            for endpoint in endpoints:
+                name = f"{endpoint.model}@{endpoint.base_url}"
+                stats = self.stats.setdefault(name, RouteStats())
+                models.append(create_chat_model(endpoint, callbacks=[LatencyCallback(stats)]))
+            model = models[0]
+            if len(models) > 1:
+                model = model.with_fallbacks(models[1:])
+            self._models[key] = model
+        return self._models[key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "routes": {route: [f"{e.model}@{e.base_url}" for e in self.get_endpoints(route)] for route in ("main", "fast")},
+            "endpoints": {name: stats.snapshot() for name, stats in self.stats.items()},
+        }
+
+
+# 创建全局实例
+llm_router = LLMRouter(config.llm_routes)
@@ -0,0 +1,35 @@
+import re
+from typing import Optional
+from app.ratelimit import GroupRateLimiter
+
+# 句子结束符，匹配到的位置之后可以切分
+SENTENCE_END = re.compile(r"[。！？!?；;…\n]+|[.](?=\s)")
+
+
+class SentenceChunker:
+    """按句子边界切分流式输出
+
+    累积模型输出的文本，只有在最后一个句子边界之前的内容达到 min_chars 时才切出一段，
+    避免把一句话拆成多条消息。
+    """
+    def __init__(self, min_chars: int):
+        self.min_chars = min_chars
+        self.buffer = ""
+
+    def feed(self, text: str):
+        self.buffer += text
+
+    def take(self) -> Optional[str]:
+        """取出一段已完成的句子，不足 min_chars 或没有句子边界时返回None"""
+        end = None
+        for match in SENTENCE_END.finditer(self.buffer):
+            end = match.end()
+        if end is None or end < self.min_chars:
+            return None
+        chunk, self.buffer = self.buffer[:end].strip(), self.buffer[end:]
+        return chunk or None
+
+    def flush(self) -> Optional[str]:
+        """取出剩余的全部内容"""
+        chunk, self.buffer = self.buffer.strip(), ""
+        return chunk or None
@@ -0,0 +1,68 @@
+import json
+import logging
+import time
+from typing import Dict, Optional, Sequence
+import tiktoken
+from langchain_core.messages import AIMessage, BaseMessage
+
+logger = logging.getLogger("uvicorn")
+
+# 每条消息的格式开销（角色、分隔符），参考 OpenAI 的计数方式
+MESSAGE_OVERHEAD = 4
+
+# 加载成功的编码，按模型名缓存
+_encodings: Dict[str, tiktoken.Encoding] = {}
+# 加载失败后的重试间隔（秒），期间使用字符数估算，不会每次计数都尝试下载
+RETRY_INTERVAL = 300
+_failed_at: Optional[float] = None
+
+def get_encoding(model: str) -> Optional[tiktoken.Encoding]:
+    """获取模型对应的编码，未知模型使用 cl100k_base，编码加载失败时返回None
+
+    只缓存加载成功的编码；失败后每隔 RETRY_INTERVAL 秒重新尝试，启动时离线不会让计数一直使用估算。
+    """
+    global _failed_at
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    if _failed_at is not None and time.monotonic() - _failed_at < RETRY_INTERVAL:
+        return None
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        _failed_at = time.monotonic()
+        logger.warning(f"加载 tiktoken 编码失败，{RETRY_INTERVAL} 秒内使用字符数估算: {str(e)}")
+        return None
+    _failed_at = None
+    _encodings[model] = encoding
+    return encoding
+
+def count_tokens(text: str, model: str) -> int:
+    """计算文本的 token 数"""
+    encoding = get_encoding(model)
+    if encoding is None:
+        # 中文约一字一token，作为离线时的保守估计
+        return len(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def count_message_tokens(message: BaseMessage, model: str) -> int:
+    """计算单条消息的 token 数，包含工具调用参数"""
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content, ensure_ascii=False)
+    tokens = MESSAGE_OVERHEAD + count_tokens(content, model)
+    if isinstance(message, AIMessage):
+        for tool_call in message.tool_calls:
+            tokens += count_tokens(tool_call["name"] + json.dumps(tool_call["args"], ensure_ascii=False), model)
+    return tokens
+
+def count_messages_tokens(messages: Sequence[BaseMessage], model: str) -> int:
+    """计算消息列表的 token 总数"""
+    return sum(count_message_tokens(message, model) for message in messages)
+
+def count_tool_schema_tokens(schemas: Sequence[dict], model: str) -> int:
+    """计算绑定到模型的工具定义的 token 数，工具定义随每次请求发送"""
+    if not schemas:
+        return 0
+    return count_tokens(json.dumps(list(schemas), ensure_ascii=False), model)
@@ -1,13 +1,31 @@
-from typing import List
+from typing import Dict, List, Optional
+import asyncio
 import inspect
 import importlib
+import logging
 import pkgutil
 from langchain.tools import BaseTool
 from app.ai.tools.abc import ToolServiceProvider
 
-def get_tools() -> List[BaseTool]:
+logger = logging.getLogger("uvicorn")
 
-    tools = []
+# 不可用的工具提供者每隔多少秒重新检查一次
+RECHECK_INTERVAL = 60
+
+# 缓存的工具提供者和已通过可用性检查的工具
+_providers: Optional[List[ToolServiceProvider]] = None
+_tools: Optional[List[BaseTool]] = None
+# 各提供者的检查结果，失败的不会一直缓存，由后台任务定期重新检查
+_available: Dict[int, bool] = {}
+_recheck_task: Optional[asyncio.Task] = None
+
+def get_providers() -> List[ToolServiceProvider]:
+    """发现所有工具提供者，结果只计算一次"""
+    global _providers
+    if _providers is not None:
+        return _providers
+
+    providers = []
     
     # 获取所有 service 目录下的模块
     service_package = importlib.import_module("app.ai.tools")
@@ -17,22 +35,86 @@ def get_tools() -> List[BaseTool]:
         
         # 遍历模块中的所有类
         for name, obj in inspect.getmembers(module):
-            # 检查是否是 ToolServiceProvider 的子类（排除基类本身）
+            # 检查是否是 ToolServiceProvider 的子类（排除基类本身和从其他模块导入的类）
             if (inspect.isclass(obj) and 
                 issubclass(obj, ToolServiceProvider) and 
-                obj != ToolServiceProvider):
+                obj != ToolServiceProvider and
+                obj.__module__ == module.__name__):
                 
-                # 获取类的实例（假设使用了单例模式）
-                if hasattr(module, name.lower()):
-                    instance = getattr(module, name.lower())
-                else:
-                    instance = obj()
-                
-                # 检查服务是否可用
-                if instance.is_tool_available():
-                    # 获取工具并添加到列表
-                    tool = instance.get_tool()
-                    if tool:
-                        tools.append(tool)
+                # 优先使用模块中创建的全局实例
+                instance = next(
+                    (value for value in vars(module).values() if isinstance(value, obj)),
+                    None
+                ) or obj()
+                providers.append(instance)
+    
+    _providers = providers
+    return _providers
+
+async def _check_provider(provider: ToolServiceProvider, timeout: float) -> bool:
+    try:
+        return await asyncio.wait_for(provider.check_available(), timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"工具可用性检查超时: {type(provider).__name__}")
+    except Exception as e:
+        logger.error(f"工具可用性检查失败: {type(provider).__name__} {str(e)}")
+    return False
+
+async def _check_providers(providers: List[ToolServiceProvider], timeout: float) -> bool:
+    """并发检查工具可用性，可用工具有变化时替换 _tools 并返回True"""
+    global _tools
+    results = await asyncio.gather(*(_check_provider(p, timeout) for p in providers))
+    changed = _tools is None
+    for provider, available in zip(providers, results):
+        changed = changed or _available.get(id(provider)) != available
+        _available[id(provider)] = available
+    if changed:
+        # 替换为新列表，使用方据此判断是否需要重新绑定工具
+        _tools = [t for p in get_providers() if _available.get(id(p)) for t in p.get_tools()]
+        logger.info(f"已加载工具: {[t.name for t in _tools]}")
+    return changed
+
+def _unavailable_providers() -> List[ToolServiceProvider]:
+    return [p for p in get_providers() if not _available.get(id(p))]
+
+async def _recheck_unavailable(timeout: float):
+    """每隔 RECHECK_INTERVAL 秒重新检查不可用的工具，全部可用后结束"""
+    while True:
+        await asyncio.sleep(RECHECK_INTERVAL)
+        unavailable = _unavailable_providers()
+        if not unavailable:
+            return
+        await _check_providers(unavailable, timeout)
+
+async def load_tools(timeout: float = 5.0) -> List[BaseTool]:
+    """返回可用工具列表
+
+    首次调用时并发检查所有工具的可用性；检查失败或超时的工具由后台任务每隔 RECHECK_INTERVAL 秒
+    重新检查，恢复后替换为新的列表（get_tools 可取到），启动时的一次超时不会让工具在整个进程中不可用。
+    """
+    global _recheck_task
+    if _tools is None:
+        await _check_providers(get_providers(), timeout)
+    if _unavailable_providers() and (_recheck_task is None or _recheck_task.done()):
+        _recheck_task = asyncio.create_task(_recheck_unavailable(timeout))
+    return _tools
+
+async def stop_recheck():
+    """停止后台重新检查工具的任务"""
+    if _recheck_task is not None and not _recheck_task.done():
+        _recheck_task.cancel()
+        await asyncio.gather(_recheck_task, return_exceptions=True)
+
+def get_tools() -> List[BaseTool]:
+    """获取可用工具，未执行过 load_tools 时按各提供者当前状态返回"""
+    if _tools is not None:
+        return _tools
+
+    tools = []
+    for provider in get_providers():
+        # 检查服务是否可用
+        if provider.is_tool_available():
+            # 获取工具并添加到列表
+            tools.extend(provider.get_tools())
     
     return tools
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from typing import List
 from langchain.tools import BaseTool
 
 
@@ -10,3 +11,11 @@ class ToolServiceProvider(ABC):
     @abstractmethod
     def get_tool(self) -> BaseTool:
         pass
+
+    def get_tools(self) -> List[BaseTool]:
+        """提供多个工具的服务应重写此方法"""
+        return [self.get_tool()]
+
+    async def check_available(self) -> bool:
+        """检查服务是否可用，需要访问外部服务的工具应重写此方法"""
+        return self.is_tool_available()
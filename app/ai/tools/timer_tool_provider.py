@@ -1,29 +1,97 @@
 import asyncio
 import logging
-from datetime import datetime, timedelta
+import uuid
+from datetime import datetime
+from typing import List, Optional
 from langchain.tools import BaseTool
 from app.ai.tools.abc import ToolServiceProvider
 from langchain_core.tools import tool
 from langchain_core.runnables import RunnableConfig
 from pydantic import BaseModel, Field
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from sqlalchemy import inspect
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from app.bot_client import bot_client
+from app.reminder_scheduler import ReminderScheduler, parse_cron
 from app.sql.client import db_client
+from app.sql.models import Reminder
+from app.sql.reminders import add_reminders, list_reminders
 
 logger = logging.getLogger("uvicorn")
 
 async def send_reminder(group_id: int, user_id: int, message: str):
     try:
         logger.info(f"发送提醒{group_id} {message}")
-        await bot_client.send_group_message(
-            group_id=group_id,
-            message=f"⏰ 定时提醒：{message}",
-            at_list=[user_id]
-        )
+        if group_id:
+            await bot_client.send_group_message(
+                group_id=group_id,
+                message=f"⏰ 定时提醒：{message}",
+                at_list=[user_id]
+            )
+        else:
+            await bot_client.send_private_message(user_id, f"⏰ 定时提醒：{message}")
     except Exception as e:
         logger.error(f"发送定时提醒失败: {str(e)}")
 
+async def send_reminders(reminders: List[Reminder]):
+    """同时发送一批到期的提醒，发往同一个群的提醒会被 BotClient 合并"""
+    await asyncio.gather(*(send_reminder(r.group_id, r.user_id, r.message) for r in reminders))
+
+def migrate_apscheduler_jobs():
+    """将旧版本保存在 APScheduler 任务表中的提醒迁移到 reminders 表，并删除任务表"""
+    if not inspect(db_client.write_engine).has_table("apscheduler_jobs"):
+        return
+    store = SQLAlchemyJobStore(engine=db_client.write_engine)
+    store.start(None, "default")
+    reminders = [
+        Reminder(
+            id=uuid.uuid4().hex,
+            fire_at=job.next_run_time.timestamp(),
+            group_id=job.args[0],
+            user_id=job.args[1],
+            message=job.args[2]
+        )
+        for job in store.get_all_jobs()
+        if job.next_run_time is not None and len(job.args) == 3
+    ]
+    add_reminders(reminders)
+    store.jobs_t.drop(db_client.write_engine)
+    logger.info(f"已迁移 {len(reminders)} 条 APScheduler 定时提醒")
+
+def build_reminder(item: BaseModel, user_id: int, group_id: Optional[int], now: datetime) -> Reminder:
+    """根据 set_timer 的参数创建提醒，参数不合法时抛出 ValueError"""
+    # 不带时区的时间按本地时间解释，与提示词中的当前时间一致
+    remind_time = item.remind_time.timestamp() if item.remind_time else None
+    interval = item.interval_minutes * 60 if item.interval_minutes else None
+    if interval is not None and interval <= 0:
+        raise ValueError("重复间隔必须大于0")
+    if item.cron:
+        trigger = parse_cron(item.cron)
+        if remind_time is None:
+            remind_time = trigger.get_next_fire_time(None, datetime.now(trigger.timezone)).timestamp()
+    elif interval and remind_time is None:
+        remind_time = now.timestamp() + interval
+    if remind_time is None:
+        raise ValueError("缺少提醒时间")
+    if not item.cron and not interval and remind_time <= now.timestamp():
+        raise ValueError("提醒时间已过")
+    return Reminder(
+        id=uuid.uuid4().hex,
+        fire_at=remind_time,
+        user_id=user_id,
+        group_id=group_id,
+        message=item.message,
+        cron=item.cron,
+        interval=interval
+    )
+
+def format_reminder(reminder: Reminder) -> str:
+    time_str = datetime.fromtimestamp(reminder.fire_at).strftime("%Y-%m-%d %H:%M:%S")
+    if reminder.cron:
+        time_str += f"（按 {reminder.cron} 重复）"
+    elif reminder.interval:
+        time_str += f"（每 {reminder.interval // 60} 分钟重复）"
+    return f"{time_str} 提醒：{reminder.message}"
+
 class TimerToolProvider(ToolServiceProvider):
     _instance = None
     _initialized = False
@@ -36,14 +104,7 @@ class TimerToolProvider(ToolServiceProvider):
     def __init__(self):
         if not TimerToolProvider._initialized:
             # 配置调度器
-            jobstores = {
-                'default': SQLAlchemyJobStore(url=db_client.url)
-            }
-            
-            self.scheduler = AsyncIOScheduler(
-                jobstores=jobstores,
-                timezone='Asia/Shanghai'
-            )
+            self.scheduler = ReminderScheduler(send_reminders)
             self.status = True
             TimerToolProvider._initialized = True
 
@@ -51,53 +112,118 @@ class TimerToolProvider(ToolServiceProvider):
         return self.status
 
     def get_tool(self) -> BaseTool:
-        class TimerInput(BaseModel):
-            remind_time: datetime = Field(
-                description="发送消息的日期时间"
-            )
+        class TimerItem(BaseModel):
             message: str = Field(
                 description="定时提醒的消息内容"
             )
+            remind_time: Optional[datetime] = Field(
+                default=None,
+                description="发送消息的日期时间，重复提醒为第一次提醒的时间，可不填"
+            )
+            cron: Optional[str] = Field(
+                default=None,
+                description="重复提醒的 crontab 表达式（分 时 日 月 周），星期使用英文缩写，"
+                            "例如每天8点为 \"0 8 * * *\"，工作日9点半为 \"30 9 * * mon-fri\""
+            )
+            interval_minutes: Optional[int] = Field(
+                default=None,
+                description="按固定间隔重复提醒的分钟数"
+            )
+
+        class TimerInput(BaseModel):
+            timers: List[TimerItem] = Field(
+                description="要设置的定时提醒，可以一次设置多个"
+            )
 
         @tool(
             "set_timer",
             args_schema=TimerInput,
         )
-        def set_timer(remind_time: datetime, message: str, config: RunnableConfig) -> str:
-            """当用户的输入中包含提醒、叫我、记得等字样时，设置一个定时提醒，可以在指定的时间发送提醒消息"""
+        async def set_timer(timers: List[TimerItem], config: RunnableConfig) -> str:
+            """当用户的输入中包含提醒、叫我、记得等字样时，设置定时提醒，可以在指定的时间或按 cron 表达式、固定间隔重复发送提醒消息"""
             group_id = config["configurable"].get("group_id")
             user_id = config["configurable"].get("user_id")
+            now = datetime.now()
+            reminders, results = [], []
+            for item in timers:
+                try:
+                    reminder = build_reminder(item, user_id, group_id, now)
+                except ValueError as e:
+                    results.append(f"设置定时提醒失败: {item.message} {str(e)}")
+                    continue
+                reminders.append(reminder)
+                results.append(f"已设置定时提醒：将在 {format_reminder(reminder)}")
             try:
                 # 添加定时任务
-                job = self.scheduler.add_job(
-                    send_reminder,
-                    'date',
-                    run_date=remind_time,
-                    args=[group_id, user_id, message],
-                    id=f"timer_{datetime.now().strftime("%Y-%m-%d-%H-%M-%S")}",
-                    replace_existing=True
-                )
-                
-                # 格式化时间
-                time_str = remind_time.strftime("%Y-%m-%d %H:%M:%S")
-                return f"已设置定时提醒：将在 {time_str} 提醒：{message}"
-                
+                await self.scheduler.add(reminders)
+                return "\n".join(results)
+
             except Exception as e:
                 logger.error(f"设置定时器失败: {str(e)}")
                 return f"设置定时器失败: {str(e)}"
 
         return set_timer
-    
+
+    def get_tools(self) -> List[BaseTool]:
+        @tool("list_timers")
+        async def list_timers(config: RunnableConfig) -> str:
+            """当用户询问设置了哪些提醒时，列出用户在当前会话中未发送的定时提醒"""
+            reminders = await asyncio.to_thread(
+                list_reminders,
+                config["configurable"].get("user_id"),
+                config["configurable"].get("group_id")
+            )
+            if not reminders:
+                return "没有待发送的定时提醒"
+            return "\n".join(f"[{r.id[:8]}] {format_reminder(r)}" for r in reminders)
+
+        class CancelInput(BaseModel):
+            ids: List[str] = Field(
+                description="要取消的提醒ID，即 list_timers 结果中方括号内的内容"
+            )
+
+        @tool(
+            "cancel_timer",
+            args_schema=CancelInput,
+        )
+        async def cancel_timer(ids: List[str], config: RunnableConfig) -> str:
+            """取消用户在当前会话中设置的定时提醒，需要先调用 list_timers 获取提醒ID"""
+            reminders = await asyncio.to_thread(
+                list_reminders,
+                config["configurable"].get("user_id"),
+                config["configurable"].get("group_id")
+            )
+            if not ids:
+                return "请提供要取消的提醒ID"
+            # 只能取消自己在当前会话中设置的提醒；每个ID必须唯一对应一个提醒，否则一个都不取消
+            matched, errors = {}, []
+            for id in ids:
+                id = id.strip()
+                candidates = [r for r in reminders if id and r.id.startswith(id)]
+                if not candidates:
+                    errors.append(f"没有找到ID为 {id or '(空)'} 的定时提醒")
+                elif len(candidates) > 1:
+                    errors.append(f"ID {id} 对应多个定时提醒，请提供更完整的ID")
+                else:
+                    matched[candidates[0].id] = candidates[0]
+            if errors:
+                return "\n".join(errors)
+            matched = list(matched.values())
+            await self.scheduler.remove(r.id for r in matched)
+            return "\n".join(f"已取消定时提醒：{format_reminder(r)}" for r in matched)
+
+        return [self.get_tool(), list_timers, cancel_timer]
+
     def start(self):
         if not self.scheduler.running:
             logger.info(f"定时任务调度器启动")
-            self.scheduler.start()
+            self.scheduler.start(before_load=migrate_apscheduler_jobs)
 
-    def shutdown(self):
+    async def shutdown(self):
         """关闭调度器"""
         if self.scheduler.running:
             logger.info(f"定时任务调度器关闭")
-            self.scheduler.shutdown()
+            await self.scheduler.stop()
 
 # 创建全局服务实例
 timer_service = TimerToolProvider() 
\ No newline at end of file
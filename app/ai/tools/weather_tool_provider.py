@@ -1,10 +1,13 @@
+import asyncio
 import httpx
 import logging
 from typing import Optional, Dict, List
 
 from langchain.tools import BaseTool
 
+from app.cache import TTLCache
 from app.config import config
+from app.metrics import WEATHER_CACHE_TOTAL
 from app.ai.tools.abc import ToolServiceProvider
 from langchain_core.tools import tool
 from pydantic import BaseModel, Field
@@ -12,34 +15,63 @@ from pydantic import BaseModel, Field
 
 logger = logging.getLogger("uvicorn")
 
+# 实时天气约10分钟更新一次，预报约1小时更新一次
+CURRENT_WEATHER_TTL = 600
+DAILY_FORECAST_TTL = 3600
+
 class WeatherToolProvider(ToolServiceProvider):
     def __init__(self):
         self.key = config.qweather_key
-        result = self.get_location_id('成都');
-        self.status = result is not None
+        # 共享连接池，复用 HTTP/2 长连接
+        self.client = httpx.AsyncClient(
+            http2=True,
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0)
+        )
+        # 城市ID基本不变，只做 LRU 淘汰
+        self.location_cache = TTLCache(maxsize=2048)
+        self.weather_cache = TTLCache(maxsize=1024)
+        # 可用性在首次加载工具时异步检查，导入模块时不访问网络
+        self.status = False
+
+    async def check_available(self) -> bool:
+        """检查和风天气API是否可用"""
+        self.status = await self.get_location_id('成都') is not None
+        return self.status
 
-    def get_location_id(self, city_name: str) -> Optional[str]:
+    async def get_location_id(self, city_name: str) -> Optional[str]:
         """通过城市名称获取位置ID"""
+        location_id = self._cache_get(self.location_cache, "location", city_name)
+        if location_id is not None:
+            return location_id
         try:
-            with httpx.Client(base_url="https://geoapi.qweather.com/v2", timeout=10.0) as client:
-                params = {
-                    "location": city_name,
-                    "key": self.key,
-                    "number": 1
-                }
-                response = client.get("/city/lookup", params=params)
-                response.raise_for_status()
-
-                data = response.json()
-                if data["code"] == "200" and data["location"]:
-                    return data["location"][0]["id"]
-                return None
+            params = {
+                "location": city_name,
+                "key": self.key,
+                "number": 1
+            }
+            response = await self.client.get(f"{config.qweather_geo_url}/city/lookup", params=params)
+            response.raise_for_status()
+
+            data = response.json()
+            if data["code"] == "200" and data["location"]:
+                location_id = data["location"][0]["id"]
+                self.location_cache.set(city_name, location_id)
+                return location_id
+            return None
 
         except Exception as e:
             logger.error(f"获取城市ID失败: {str(e)}")
             return None
 
-    def get_weather(self, location_id: str) -> Optional[Dict]:
+    @staticmethod
+    def _cache_get(cache: TTLCache, name: str, key):
+        """读取缓存并记录命中情况"""
+        value = cache.get(key)
+        WEATHER_CACHE_TOTAL.inc(name, "miss" if value is None else "hit")
+        return value
+
+    async def get_weather(self, location_id: str) -> Optional[Dict]:
         """获取7天天气预报
 
         Args:
@@ -49,14 +81,12 @@ class WeatherToolProvider(ToolServiceProvider):
             Dict: 包含实时天气和未来7天预报的字典
         """
         try:
-            # 获取实时天气
-            current_weather = self._get_current_weather(location_id)
-            if not current_weather:
-                return None
-
-            # 获取7天预报
-            daily_forecast = self._get_daily_forecast(location_id)
-            if not daily_forecast:
+            # 并发获取实时天气和7天预报
+            current_weather, daily_forecast = await asyncio.gather(
+                self._get_current_weather(location_id),
+                self._get_daily_forecast(location_id)
+            )
+            if not current_weather or not daily_forecast:
                 return None
 
             return {
@@ -68,53 +98,69 @@ class WeatherToolProvider(ToolServiceProvider):
             logger.error(f"获取天气信息失败: {str(e)}")
             return None
 
-    def _get_current_weather(self, location_id: str) -> Optional[Dict]:
+    async def _get_current_weather(self, location_id: str) -> Optional[Dict]:
         """获取实时天气"""
-        with httpx.Client(base_url="https://devapi.qweather.com/v7", timeout=10.0) as client:
-            params = {
-                "location": location_id,
-                "key": self.key
+        cache_key = ("now", location_id)
+        current = self._cache_get(self.weather_cache, "now", cache_key)
+        if current is not None:
+            return current
+
+        params = {
+            "location": location_id,
+            "key": self.key
+        }
+        response = await self.client.get(f"{config.qweather_api_url}/weather/now", params=params)
+        response.raise_for_status()
+
+        data = response.json()
+        if data["code"] == "200":
+            current = {
+                "temp": data["now"]["temp"],
+                "text": data["now"]["text"],
+                "feelsLike": data["now"]["feelsLike"],
+                "humidity": data["now"]["humidity"],
+                "windDir": data["now"]["windDir"],
+                "windScale": data["now"]["windScale"],
+                "time": "现在"
             }
-            response = client.get("/weather/now", params=params)
-            response.raise_for_status()
-
-            data = response.json()
-            if data["code"] == "200":
-                return {
-                    "temp": data["now"]["temp"],
-                    "text": data["now"]["text"],
-                    "feelsLike": data["now"]["feelsLike"],
-                    "humidity": data["now"]["humidity"],
-                    "windDir": data["now"]["windDir"],
-                    "windScale": data["now"]["windScale"],
-                    "time": "现在"
-                }
-            return None
+            self.weather_cache.set(cache_key, current, ttl=CURRENT_WEATHER_TTL)
+            return current
+        return None
 
-    def _get_daily_forecast(self, location_id: str) -> Optional[List[Dict]]:
+    async def _get_daily_forecast(self, location_id: str) -> Optional[List[Dict]]:
         """获取7天预报"""
-        with httpx.Client(base_url="https://devapi.qweather.com/v7", timeout=10.0) as client:
-            params = {
-                "location": location_id,
-                "key": self.key
-            }
-            response = client.get("/weather/7d", params=params)
-            response.raise_for_status()
-
-            data = response.json()
-            if data["code"] == "200":
-                return [{
-                    "date": day["fxDate"],
-                    "tempMax": day["tempMax"],
-                    "tempMin": day["tempMin"],
-                    "textDay": day["textDay"],
-                    "textNight": day["textNight"],
-                    "uvIndex": day["uvIndex"],
-                    "windDirDay": day["windDirDay"],
-                    "windScaleDay": day["windScaleDay"],
-                    "humidity": day["humidity"]
-                } for day in data["daily"]]
-            return None
+        cache_key = ("7d", location_id)
+        daily = self._cache_get(self.weather_cache, "7d", cache_key)
+        if daily is not None:
+            return daily
+
+        params = {
+            "location": location_id,
+            "key": self.key
+        }
+        response = await self.client.get(f"{config.qweather_api_url}/weather/7d", params=params)
+        response.raise_for_status()
+
+        data = response.json()
+        if data["code"] == "200":
+            daily = [{
+                "date": day["fxDate"],
+                "tempMax": day["tempMax"],
+                "tempMin": day["tempMin"],
+                "textDay": day["textDay"],
+                "textNight": day["textNight"],
+                "uvIndex": day["uvIndex"],
+                "windDirDay": day["windDirDay"],
+                "windScaleDay": day["windScaleDay"],
+                "humidity": day["humidity"]
+            } for day in data["daily"]]
+            self.weather_cache.set(cache_key, daily, ttl=DAILY_FORECAST_TTL)
+            return daily
+        return None
+
+    async def close(self):
+        """关闭连接池"""
+        await self.client.aclose()
 
     def is_tool_available(self) -> bool:
         return self.status
@@ -130,7 +176,7 @@ class WeatherToolProvider(ToolServiceProvider):
             "get_weather",
             args_schema=WeatherInput,
         )
-        def get_weather(location: str) -> str:
+        async def get_weather(location: str) -> str:
             """获取指定位置的天气信息。
 
             Args:
@@ -139,7 +185,7 @@ class WeatherToolProvider(ToolServiceProvider):
             Returns:
                 str: 天气信息
             """
-            return get_city_weather(location)
+            return await get_city_weather(location)
 
         return get_weather
 
@@ -149,7 +195,7 @@ class WeatherToolProvider(ToolServiceProvider):
 weather_service = WeatherToolProvider()
 
 # 天气工具存在的问题是ai会回复历史问题
-def get_city_weather(city_name: str) -> str:
+async def get_city_weather(city_name: str) -> str:
     """获取城市天气信息
 
     Args:
@@ -158,12 +204,12 @@ def get_city_weather(city_name: str) -> str:
     Returns:
         str: 格式化的天气信息字符串
     """
-    location_id = weather_service.get_location_id(city_name)
+    location_id = await weather_service.get_location_id(city_name)
     if not location_id:
         logger.error(f"未找到城市: {city_name}")
         return f"未找到城市: {city_name}"
 
-    weather_info = weather_service.get_weather(location_id)
+    weather_info = await weather_service.get_weather(location_id)
     if not weather_info:
         logger.error(f"获取天气信息失败: {city_name}")
         return f"获取天气信息失败: {city_name}"
@@ -1,86 +1,201 @@
-from typing import List
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
 import httpx
 import logging
+import time
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+from app.config import config
+from app.metrics import ONEBOT_SEND_FAILURES_TOTAL, ONEBOT_SEND_SECONDS, group_label
+from app.ratelimit import GroupRateLimiter
+from app.tracing import span
 
 logger = logging.getLogger("uvicorn")
 
+# 发送目标: ("group", 群号) 或 ("private", QQ号)
+Target = Tuple[str, int]
+
+def is_transient(error: BaseException) -> bool:
+    """连接失败和网关错误可以重试
+
+    读超时不重试：请求可能已经被处理，重试会导致重复发送。
+    """
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)):
+        return True
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code in (502, 503, 504)
+
+class _Outgoing:
+    """排队中的一条消息"""
+    __slots__ = ("segments", "length", "future", "merge")
+
+    def __init__(self, segments: List[Dict[str, Any]], length: int, future: asyncio.Future, merge: bool = True):
+        self.segments = segments
+        self.length = length
+        self.future = future
+        self.merge = merge
+
 class BotClient:
-    """Bot HTTP客户端"""
+    """Bot HTTP客户端
+
+    每个群/私聊有独立的发送队列，按令牌桶限速发送；
+    排队期间积累的相邻消息合并为一条发送。
+    """
     _instance = None
     _initialized = False
-    
+
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
-    
+
     def __init__(self):
         if not BotClient._initialized:
+            headers = {"Authorization": f"Bearer {config.onebot_access_token}"} if config.onebot_access_token else None
             self.client = httpx.AsyncClient(
-                base_url="http://192.168.2.53:3000",
-                timeout=30.0
+                base_url=config.onebot_base_url,
+                timeout=config.onebot_timeout,
+                headers=headers,
+                limits=httpx.Limits(
+                    max_connections=config.onebot_max_connections,
+                    max_keepalive_connections=config.onebot_max_keepalive,
+                    keepalive_expiry=30
+                )
             )
+            self.rate_limiter = GroupRateLimiter(config.onebot_send_interval, capacity=config.onebot_send_burst)
+            self.merge_max_chars = config.onebot_merge_max_chars
+            self.max_attempts = config.onebot_max_attempts
+            self._queues: Dict[Target, Deque[_Outgoing]] = {}
+            self._workers: Dict[Target, asyncio.Task] = {}
             BotClient._initialized = True
-    
-    async def send_group_message(self, group_id: int, message: str, at_list: List[int] = []) -> bool:
+
+    async def send_group_message(self, group_id: int, message: str, at_list: List[int] = [], merge: bool = True) -> bool:
         """发送群消息
-        
+
         Args:
             group_id: 群号
             message: 消息内容
             at_list: at数组
-            
+            merge: 是否允许与队列中相邻的消息合并发送，流式回复的分段应单独发送
+
         Returns:
             bool: 是否发送成功
         """
-        try:
-            
-            at_segments = [
-                {
-                    "type": "at",
-                    "data": {
-                        "qq": at_id
-                    }
+        at_segments = [
+            {
+                "type": "at",
+                "data": {
+                    "qq": at_id
                 }
-                for at_id in at_list
-            ]
-            
-            response = await self.client.post("/send_group_msg", json={
-                "group_id": group_id,
-                "message": [
-                    *at_segments,
-                    {
-                        "type": "text",
-                        "data": {
-                            "text": message
-                        }
-                    }
-                ]
-            })
-            response.raise_for_status()
-            
+            }
+            for at_id in at_list
+        ]
+        segments = [*at_segments, {"type": "text", "data": {"text": message}}]
+        return await self._enqueue(("group", group_id), segments, len(message), merge)
+
+    async def send_private_message(self, user_id: int, message: str) -> bool:
+        """发送私聊消息
+
+        Args:
+            user_id: 对方QQ号
+            message: 消息内容
+
+        Returns:
+            bool: 是否发送成功
+        """
+        segments = [{"type": "text", "data": {"text": message}}]
+        return await self._enqueue(("private", user_id), segments, len(message))
+
+    async def _enqueue(self, target: Target, segments: List[Dict[str, Any]], length: int, merge: bool = True) -> bool:
+        """加入目标的发送队列，等待发送结果"""
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(target, deque()).append(_Outgoing(segments, length, future, merge))
+        if target not in self._workers:
+            self._workers[target] = asyncio.create_task(self._drain(target))
+        # 包括排队、限速等待和重试的时间
+        with span("onebot.send", kind=target[0]):
+            return await future
+
+    async def _drain(self, target: Target):
+        """依次发送目标队列中的消息，队列清空后退出"""
+        kind, target_id = target
+        queue = self._queues[target]
+        bucket = self.rate_limiter.get_bucket(target)
+        try:
+            while queue:
+                # 等待令牌期间新到的消息会与队首合并
+                await bucket.acquire()
+                batch = [queue.popleft()]
+                length = batch[0].length
+                while (batch[0].merge and queue and queue[0].merge
+                       and length + queue[0].length <= self.merge_max_chars):
+                    item = queue.popleft()
+                    batch.append(item)
+                    length += item.length
+
+                segments = list(batch[0].segments)
+                for item in batch[1:]:
+                    segments.append({"type": "text", "data": {"text": "\n"}})
+                    segments.extend(item.segments)
+                group = group_label(target_id if kind == "group" else None)
+                started = time.perf_counter()
+                if kind == "group":
+                    ok = await self._post("/send_group_msg", {"group_id": target_id, "message": segments}, "群消息")
+                else:
+                    ok = await self._post("/send_private_msg", {"user_id": target_id, "message": segments}, "私聊消息")
+                ONEBOT_SEND_SECONDS.observe(time.perf_counter() - started, kind, group)
+                if not ok:
+                    ONEBOT_SEND_FAILURES_TOTAL.inc(kind, group)
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_result(ok)
+        finally:
+            for item in queue:
+                if not item.future.done():
+                    item.future.set_result(False)
+            del self._queues[target]
+            del self._workers[target]
+
+    async def _post(self, path: str, payload: Dict[str, Any], label: str) -> bool:
+        """调用 OneBot 接口，连接失败和网关错误按指数退避重试"""
+        try:
+            async for attempt in AsyncRetrying(
+                retry=retry_if_exception(is_transient),
+                wait=wait_random_exponential(multiplier=0.5, max=5),
+                stop=stop_after_attempt(self.max_attempts),
+                reraise=True,
+            ):
+                with attempt:
+                    response = await self.client.post(path, json=payload)
+                    response.raise_for_status()
+
             data = response.json()
             if data.get("status") == "ok":
                 return True
-                
-            logger.error(f"发送群消息失败: {data}")
+
+            logger.error(f"发送{label}失败: {data}")
             return False
-            
+
         except Exception as e:
-            logger.error(f"发送群消息出错: {str(e)}")
+            logger.error(f"发送{label}出错: {str(e)}")
             return False
-    
+
     @classmethod
     def get_instance(cls) -> 'BotClient':
         """获取BotClient实例"""
         if cls._instance is None:
             cls._instance = BotClient()
         return cls._instance
-    
-    async def close(self):
-        """关闭客户端"""
+
+    async def close(self, timeout: float = 10.0):
+        """等待队列中的消息发送完成后关闭客户端"""
+        workers = list(self._workers.values())
+        if workers:
+            _, pending = await asyncio.wait(workers, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
         if self.client:
             await self.client.aclose()
 
 # 创建全局实例
-bot_client = BotClient.get_instance()
\ No newline at end of file
+bot_client = BotClient.get_instance()
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Set
+
+logger = logging.getLogger("uvicorn")
+
+Flush = Callable[[List[str]], Awaitable[None]]
+
+
+class _Batch:
+    """等待合并的一组消息"""
+    __slots__ = ("contents", "flush", "timer")
+
+    def __init__(self, content: str, flush: Flush):
+        self.contents = [content]
+        self.flush = flush
+        self.timer: asyncio.TimerHandle = None
+
+
+class MessageCoalescer:
+    """消息合并器
+
+    同一会话在窗口期内连续发送的多条消息合并为一次回复：
+    窗口内第一条消息登记回调并用 call_later 定时，窗口结束时在单独的任务中以全部消息内容调用回调；
+    其余消息只追加内容。调用者都立即返回，不会在窗口期内占用事件队列的 worker。
+    """
+    def __init__(self):
+        self._pending: Dict[str, _Batch] = {}
+        # 正在执行的回调任务，保存引用避免被回收
+        self._tasks: Set[asyncio.Task] = set()
+
+    def submit(self, key: str, content: str, window: float, flush: Flush) -> bool:
+        """加入窗口期内的消息
+
+        Args:
+            key: 会话ID
+            content: 消息内容
+            window: 窗口时长（秒）
+            flush: 窗口结束时以本批所有消息内容调用的回调
+
+        Returns:
+            bool: 开启了新的批次时返回True，已合并到现有批次时返回False
+        """
+        batch = self._pending.get(key)
+        if batch is not None:
+            batch.contents.append(content)
+            return False
+
+        batch = self._pending[key] = _Batch(content, flush)
+        batch.timer = asyncio.get_running_loop().call_later(window, self._flush, key)
+        return True
+
+    def _flush(self, key: str):
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: _Batch):
+        try:
+            await batch.flush(batch.contents)
+        except Exception as e:
+            logger.exception(f"处理合并的消息出错: {str(e)}")
+
+    async def close(self):
+        """立即处理所有等待中的批次，并等待回调完成"""
+        for key, batch in list(self._pending.items()):
+            batch.timer.cancel()
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+# 创建全局实例
+message_coalescer = MessageCoalescer()
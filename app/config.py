@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Literal
 import tomli
 import os
 
@@ -10,6 +10,14 @@ class GroupConfig(BaseModel):
     at_only: bool = True
     allowed_users: List[int] = []
     black_list: List[int] = []  # 群组黑名单列表
+    debounce: float = 0.0  # 合并同一用户连续消息的窗口（秒），0表示不合并
+
+class LLMEndpoint(BaseModel):
+    """模型服务地址，兼容 OpenAI 接口（ollama 使用 http://host:11434/v1）"""
+    base_url: str
+    api_key: str = "EMPTY"  # ollama 等本地服务不校验，但不能为空
+    model: str
+    timeout: float = 60  # 请求超时（秒），超时后切换到下一个地址
 
 class Settings(BaseSettings):
     # OpenAI 配置
@@ -19,10 +27,24 @@ class Settings(BaseSettings):
     
     # 和风天气配置
     qweather_key: str
+    qweather_geo_url: str = "https://geoapi.qweather.com/v2"
+    qweather_api_url: str = "https://devapi.qweather.com/v7"
+    
+    # OneBot 配置
+    onebot_base_url: str = "http://192.168.2.53:3000"  # OneBot HTTP API 地址
+    onebot_access_token: str = ""  # OneBot access_token，为空时不发送
+    onebot_timeout: float = 30  # 请求超时（秒）
+    onebot_max_connections: int = 20  # 连接池最大连接数
+    onebot_max_keepalive: int = 10  # 连接池保持的空闲连接数
+    onebot_send_interval: float = 1.0  # 同一群/用户两条消息的平均间隔（秒）
+    onebot_send_burst: int = 3  # 空闲后允许连续发送的消息数
+    onebot_max_attempts: int = 3  # 网络错误、5xx 时的最大尝试次数
+    onebot_merge_max_chars: int = 1500  # 合并排队中的消息时单条消息的最大长度
     
     # 用户配置
     bot_id: int
     allowed_users: List[int] = []  # 允许私聊的用户列表
+    policy_reload_interval: float = 5.0  # 检查 config.toml 修改并重新加载用户、群组配置的间隔（秒），0表示不检查
     
     # 群组配置
     groups: Dict[int, GroupConfig] = {}
@@ -30,6 +52,65 @@ class Settings(BaseSettings):
     # 指令配置
     command_prefix: str = "/"  # 指令前缀
     
+    # 事件队列配置
+    queue_enabled: bool = False  # 是否启用后台队列（收到事件后立即返回）
+    queue_workers: int = 4  # 消费队列的worker数量
+    queue_max_size: int = 1000  # 队列最大长度
+    queue_put_timeout: float = 1.0  # 队列满时等待入队的最长时间（秒）
+    
+    # 数据库配置
+    history_durability: Literal["sync", "buffered"] = "sync"  # 聊天记录写入方式
+    history_batch_size: int = 100  # 缓冲写入时每批最多记录数
+    history_flush_interval: float = 1.0  # 缓冲写入的刷新间隔（秒）
+    sqlite_synchronous: Literal["OFF", "NORMAL", "FULL"] = "NORMAL"  # WAL 模式下 NORMAL 只在检查点时同步
+    sqlite_busy_timeout: int = 5000  # 等待数据库锁的毫秒数
+    sqlite_mmap_size: int = 268435456  # 内存映射大小（字节）
+    sqlite_cache_size: int = -65536  # 页缓存大小，负数表示KiB
+    sqlite_read_pool_size: int = 5  # 读连接池大小
+    
+    # 上下文配置
+    context_budget: int = 6000  # 发送给模型的最大提示词 token 数
+    context_budgets: Dict[str, int] = {}  # 按模型覆盖 context_budget
+    tool_result_max_chars: int = 300  # 工具结果在所属轮次结束后保留的最大字符数
+    prompt_layout: Literal["cached", "legacy"] = "cached"  # 提示词布局
+    
+    # 模型路由配置
+    llm_routes: Dict[str, List[LLMEndpoint]] = {}  # main/fast 路由的模型地址，按顺序故障转移
+    llm_fast_max_chars: int = 20  # 不超过该长度的消息由 fast 路由回复，0表示不使用
+    llm_max_concurrency: int = 8  # 同时进行的模型请求数
+    llm_rpm: int = 0  # 每分钟请求数上限，0表示不限制
+    llm_tpm: int = 0  # 每分钟 token 数上限，0表示不限制
+    llm_max_attempts: int = 4  # 限流、超时等错误的最大尝试次数
+    llm_retry_max_wait: float = 20  # 重试退避的最长等待（秒）
+    
+    # 对话总结配置
+    summary_token_threshold: int = 2000  # 对话消息超过该 token 数时在后台生成总结
+    
+    # 流式回复配置
+    stream_enabled: bool = False  # 是否按句子分段发送群聊回复
+    stream_min_chars: int = 20  # 每段消息的最少字符数
+    
+    # 聊天记录归档配置
+    archive_enabled: bool = False  # 是否定期归档旧聊天记录
+    archive_retention_days: int = 90  # 热表保留的天数
+    archive_interval_hours: float = 24  # 归档任务执行间隔（小时）
+    archive_dir: str = ".data/archive"  # 按月分库的归档目录
+    
+    # 回复缓存配置
+    response_cache_enabled: bool = False  # 是否缓存相同问题的回复
+    response_cache_ttl: float = 600  # 缓存有效期（秒）
+    response_cache_maxsize: int = 1024  # 最多缓存的回复数
+    response_cache_tools: List[str] = ["get_weather"]  # 只缓存调用了这些工具、且工具参数都出现在问题中的回复
+    response_cache_embedding_model: str = ""  # 相似问题匹配使用的嵌入模型，为空时只精确匹配
+    response_cache_similarity: float = 0.92  # 相似问题匹配的余弦相似度阈值
+    
+    # 对话追踪配置
+    tracing_sample_rate: float = 0.0  # 记录并输出对话追踪的比例
+    tracing_slow_turn: float = 10.0  # 耗时超过该秒数的对话输出完整追踪，0表示关闭
+    tracing_profile_dir: str = ".data/profiles"  # cProfile 结果保存目录
+    tracing_debug_token: str = ""  # /debug 接口的访问令牌，为空时不开放
+    graph_debug: bool = False  # 是否打印 LangGraph 每一步的调试输出
+    
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -47,15 +128,46 @@ def load_config() -> Settings:
                 config_dict["openai_api_key"] = toml_config["openai"].get("api_key")
                 config_dict["openai_base_url"] = toml_config["openai"].get("base_url")
                 config_dict["openai_model"] = toml_config["openai"].get("model")
+                config_dict["context_budget"] = toml_config["openai"].get("context_budget", 6000)
+                config_dict["context_budgets"] = toml_config["openai"].get("context_budgets", {})
+                config_dict["tool_result_max_chars"] = toml_config["openai"].get("tool_result_max_chars", 300)
+                config_dict["prompt_layout"] = toml_config["openai"].get("prompt_layout", "cached")
             
             # 和风天气配置
             if "api" in toml_config:
                 config_dict["qweather_key"] = toml_config["api"].get("qweather_key")
+                config_dict["qweather_geo_url"] = toml_config["api"].get("qweather_geo_url", "https://geoapi.qweather.com/v2")
+                config_dict["qweather_api_url"] = toml_config["api"].get("qweather_api_url", "https://devapi.qweather.com/v7")
+            
+            # OneBot 配置
+            if "onebot" in toml_config:
+                onebot_config = toml_config["onebot"]
+                config_dict["onebot_base_url"] = onebot_config.get("base_url", "http://192.168.2.53:3000")
+                config_dict["onebot_access_token"] = onebot_config.get("access_token", "")
+                config_dict["onebot_timeout"] = onebot_config.get("timeout", 30)
+                config_dict["onebot_max_connections"] = onebot_config.get("max_connections", 20)
+                config_dict["onebot_max_keepalive"] = onebot_config.get("max_keepalive", 10)
+                config_dict["onebot_send_interval"] = onebot_config.get("send_interval", 1.0)
+                config_dict["onebot_send_burst"] = onebot_config.get("send_burst", 3)
+                config_dict["onebot_max_attempts"] = onebot_config.get("max_attempts", 3)
+                config_dict["onebot_merge_max_chars"] = onebot_config.get("merge_max_chars", 1500)
+            
+            # 模型路由配置
+            if "llm" in toml_config:
+                llm_config = toml_config["llm"]
+                config_dict["llm_routes"] = llm_config.get("routes", {})
+                config_dict["llm_fast_max_chars"] = llm_config.get("fast_max_chars", 20)
+                config_dict["llm_max_concurrency"] = llm_config.get("max_concurrency", 8)
+                config_dict["llm_rpm"] = llm_config.get("rpm", 0)
+                config_dict["llm_tpm"] = llm_config.get("tpm", 0)
+                config_dict["llm_max_attempts"] = llm_config.get("max_attempts", 4)
+                config_dict["llm_retry_max_wait"] = llm_config.get("retry_max_wait", 20)
             
             # 用户配置
             if "users" in toml_config:
                 config_dict["bot_id"] = toml_config["users"].get("bot_id")
                 config_dict["allowed_users"] = toml_config["users"].get("allowed_users", [])
+                config_dict["policy_reload_interval"] = toml_config["users"].get("reload_interval", 5.0)
             
             # 群组配置
             if "groups" in toml_config:
@@ -66,10 +178,72 @@ def load_config() -> Settings:
                         id=group_id,
                         at_only=group.get("at_only", True),
                         allowed_users=group.get("allowed_users", []),
-                        black_list=group.get("black_list", [])
+                        black_list=group.get("black_list", []),
+                        debounce=group.get("debounce", 0.0)
                     )
                 config_dict["groups"] = groups_dict
+            
+            # 事件队列配置
+            if "queue" in toml_config:
+                queue_config = toml_config["queue"]
+                config_dict["queue_enabled"] = queue_config.get("enabled", False)
+                config_dict["queue_workers"] = queue_config.get("workers", 4)
+                config_dict["queue_max_size"] = queue_config.get("max_size", 1000)
+                config_dict["queue_put_timeout"] = queue_config.get("put_timeout", 1.0)
+            
+            # 数据库配置
+            if "database" in toml_config:
+                database_config = toml_config["database"]
+                config_dict["history_durability"] = database_config.get("history_durability", "sync")
+                config_dict["history_batch_size"] = database_config.get("history_batch_size", 100)
+                config_dict["history_flush_interval"] = database_config.get("history_flush_interval", 1.0)
+                config_dict["sqlite_synchronous"] = database_config.get("synchronous", "NORMAL")
+                config_dict["sqlite_busy_timeout"] = database_config.get("busy_timeout", 5000)
+                config_dict["sqlite_mmap_size"] = database_config.get("mmap_size", 268435456)
+                config_dict["sqlite_cache_size"] = database_config.get("cache_size", -65536)
+                config_dict["sqlite_read_pool_size"] = database_config.get("read_pool_size", 5)
+            
+            # 对话总结配置
+            if "summary" in toml_config:
+                config_dict["summary_token_threshold"] = toml_config["summary"].get("token_threshold", 2000)
+            
+            # 流式回复配置
+            if "stream" in toml_config:
+                stream_config = toml_config["stream"]
+                config_dict["stream_enabled"] = stream_config.get("enabled", False)
+                config_dict["stream_min_chars"] = stream_config.get("min_chars", 20)
+            
+            # 聊天记录归档配置
+            if "archive" in toml_config:
+                archive_config = toml_config["archive"]
+                config_dict["archive_enabled"] = archive_config.get("enabled", False)
+                config_dict["archive_retention_days"] = archive_config.get("retention_days", 90)
+                config_dict["archive_interval_hours"] = archive_config.get("interval_hours", 24)
+                config_dict["archive_dir"] = archive_config.get("dir", ".data/archive")
+            
+            # 回复缓存配置
+            if "response_cache" in toml_config:
+                cache_config = toml_config["response_cache"]
+                config_dict["response_cache_enabled"] = cache_config.get("enabled", False)
+                config_dict["response_cache_ttl"] = cache_config.get("ttl", 600)
+                config_dict["response_cache_maxsize"] = cache_config.get("maxsize", 1024)
+                config_dict["response_cache_tools"] = cache_config.get("tools", ["get_weather"])
+                config_dict["response_cache_embedding_model"] = cache_config.get("embedding_model", "")
+                config_dict["response_cache_similarity"] = cache_config.get("similarity", 0.92)
+            
+            # 对话追踪配置
+            if "tracing" in toml_config:
+                tracing_config = toml_config["tracing"]
+                config_dict["tracing_sample_rate"] = tracing_config.get("sample_rate", 0.0)
+                config_dict["tracing_slow_turn"] = tracing_config.get("slow_turn", 10.0)
+                config_dict["tracing_profile_dir"] = tracing_config.get("profile_dir", ".data/profiles")
+                config_dict["tracing_debug_token"] = tracing_config.get("debug_token", "")
+                config_dict["graph_debug"] = tracing_config.get("graph_debug", False)
     
     return Settings(**config_dict)
 
+def get_context_budget(model: str) -> int:
+    """获取模型的提示词 token 预算"""
+    return config.context_budgets.get(model, config.context_budget)
+
 config = load_config()
\ No newline at end of file
@@ -0,0 +1,52 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict
+
+
+class _KeyState:
+    """单个会话的锁和等待者计数"""
+    __slots__ = ("lock", "refs")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.refs = 0
+
+
+class ConversationScheduler:
+    """会话调度器
+
+    同一个 thread_id 的消息严格按到达顺序串行处理（asyncio.Lock 按 FIFO 唤醒等待者），
+    不同 thread_id 之间并行。会话没有正在处理或等待的消息时立即删除其状态，
+    内存占用只与活跃会话数量相关。
+    """
+    def __init__(self):
+        self._states: Dict[str, _KeyState] = {}
+
+    @property
+    def active(self) -> int:
+        """当前有消息在处理或等待的会话数"""
+        return len(self._states)
+
+    @asynccontextmanager
+    async def serialize(self, key: str):
+        """在同一会话内串行执行
+
+        用法:
+            async with conversation_scheduler.serialize(thread_id):
+                ...
+        """
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _KeyState()
+        state.refs += 1
+        try:
+            async with state.lock:
+                yield
+        finally:
+            state.refs -= 1
+            if state.refs == 0:
+                del self._states[key]
+
+
+# 创建全局实例
+conversation_scheduler = ConversationScheduler()
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+from app.config import config
+from app.stats import percentile
+
+logger = logging.getLogger("uvicorn")
+
+
+class QueueStats:
+    """队列统计信息"""
+    def __init__(self, window: int = 1024):
+        self.enqueued = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        # 最近的排队等待时间，用于计算分位数
+        self.recent_waits: Deque[float] = deque(maxlen=window)
+
+    def record_wait(self, wait: float):
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.recent_waits.append(wait)
+
+    def snapshot(self) -> Dict[str, Any]:
+        waits: List[float] = sorted(self.recent_waits)
+        started = self.processed + self.failed
+        return {
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "wait_avg": self.wait_total / started if started else 0.0,
+            "wait_max": self.wait_max,
+            "wait_p50": percentile(waits, 50),
+            "wait_p95": percentile(waits, 95),
+            "wait_p99": percentile(waits, 99),
+        }
+
+
+class EventQueue:
+    """有界事件队列
+
+    webhook 只负责校验和入队，由固定数量的 worker 在后台消费。
+    队列满时入队会等待 put_timeout 秒（背压），仍然失败则拒绝该事件。
+    """
+    def __init__(self, workers: int, max_size: int, put_timeout: float):
+        self.workers = workers
+        self.put_timeout = put_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self.stats = QueueStats()
+        self._tasks: List[asyncio.Task] = []
+        self._handler: Optional[Callable[[Any], Awaitable[None]]] = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self, handler: Callable[[Any], Awaitable[None]]):
+        """启动worker"""
+        if self.running:
+            return
+        self._handler = handler
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"event-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"事件队列启动, worker数量: {self.workers}")
+
+    async def put(self, item: Any) -> bool:
+        """事件入队，成功返回True，队列持续满载时返回False"""
+        try:
+            await asyncio.wait_for(self.queue.put((time.monotonic(), item)), timeout=self.put_timeout)
+        except asyncio.TimeoutError:
+            self.stats.rejected += 1
+            logger.warning(f"事件队列已满，丢弃事件: {item}")
+            return False
+        self.stats.enqueued += 1
+        return True
+
+    async def _worker(self, index: int):
+        while True:
+            enqueued_at, item = await self.queue.get()
+            self.stats.record_wait(time.monotonic() - enqueued_at)
+            try:
+                await self._handler(item)
+                self.stats.processed += 1
+            except Exception as e:
+                self.stats.failed += 1
+                logger.exception(f"处理事件出错: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    async def stop(self, timeout: float = 10.0):
+        """等待队列中剩余事件处理完后关闭worker"""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"事件队列关闭超时，剩余 {self.queue.qsize()} 个事件未处理")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("事件队列关闭")
+
+
+# 创建全局实例
+event_queue = EventQueue(
+    workers=config.queue_workers,
+    max_size=config.queue_max_size,
+    put_timeout=config.queue_put_timeout
+)
@@ -1,15 +1,53 @@
+import asyncio
 import logging
+from typing import List, Tuple
 from app.bot_client import BotClient
-from app.model import GroupMessage, MetaEventReport, NoticeReport, PrivateMessage, RequestReport
+from app.model import BasicMessage, GroupMessage, MetaEventReport, NoticeReport, PrivateMessage, RequestReport
 from app.config import config
-from app.message_formatter import format_message
+from app.conversation_scheduler import conversation_scheduler
+from app.coalescer import message_coalescer
+from app.message_formatter import FormattedMessage, format_message
+from app.policy import get_policy
 from app.ai.ai_handler import AIHandler
+from app.ai.streaming import SentenceChunker
 from app.sql.chat_history import add_chat_history
 from app.sql.models import MessageRole
+from app.tracing import tracer
 
 logger = logging.getLogger("uvicorn")
 ai_handler = AIHandler.get_instance()
 
+async def stream_group_reply(formattedMessage: FormattedMessage, content: str) -> str:
+    """流式生成回复，按句子分段发送到群，返回实际发送成功的内容
+
+    发送间隔由 BotClient 的发送队列统一限速，这里只查看该群的令牌桶：
+    未到发送时间时继续累积，下次与后续句子合并成一段，已切出的段落不再被发送队列合并。
+    分段交给发送队列后不等待发送完成，继续读取模型输出，结束时再等待全部发送结果。
+    """
+    group_id = formattedMessage.raw.group_id
+    bot_client = BotClient.get_instance()
+    bucket = bot_client.rate_limiter.get_bucket(("group", group_id))
+    chunker = SentenceChunker(config.stream_min_chars)
+    # (分段内容, 发送任务)，任务按创建顺序入队，保持分段顺序
+    sends: List[Tuple[str, asyncio.Task]] = []
+
+    def send(chunk: str):
+        sends.append((chunk, asyncio.create_task(bot_client.send_group_message(group_id, chunk, merge=False))))
+
+    try:
+        async for text in ai_handler.stream_response(formattedMessage, content):
+            chunker.feed(text)
+            if bucket.delay() == 0:
+                chunk = chunker.take()
+                if chunk:
+                    send(chunk)
+        rest = chunker.flush()
+        if rest:
+            send(rest)
+    finally:
+        results = await asyncio.gather(*(task for _, task in sends), return_exceptions=True)
+    return "\n".join(chunk for (chunk, _), sent in zip(sends, results) if sent is True)
+
 async def handle_private_message(message: PrivateMessage) -> None:
     formattedMessage = format_message(message)
     """处理私聊消息"""
@@ -18,26 +56,31 @@ async def handle_private_message(message: PrivateMessage) -> None:
 
     logger.info(f"收到私聊消息: {formattedMessage.raw.raw_message} (纯文本: {formattedMessage.content}, @: {formattedMessage.at_list})")
     
-    # 记录用户消息
-    add_chat_history(
-        content=formattedMessage.content,
-        user_id=message.user_id,
-        role=MessageRole.HUMAN
-    )
-    
-    try:
-        response = ai_handler.get_response(formattedMessage)
-        if response:
-            logger.info(f"AI响应: {response}")
-            await BotClient.get_instance().send_private_message(message.user_id, response)
-            # 记录AI响应
-            add_chat_history(
-                content=response,
-                user_id=message.user_id,
-                role=MessageRole.AI
-            )
-    except Exception as e:
-        logger.error(f"处理私聊消息出错: {str(e)}")
+    # 同一会话的消息串行处理，避免并发写同一个检查点；追踪从排队开始计时
+    async with (
+        tracer.turn("private", thread_id=formattedMessage.thread_id, user_id=message.user_id),
+        conversation_scheduler.serialize(formattedMessage.thread_id)
+    ):
+        # 记录用户消息
+        await add_chat_history(
+            content=formattedMessage.content,
+            user_id=message.user_id,
+            role=MessageRole.HUMAN
+        )
+        
+        try:
+            response = await ai_handler.get_response(formattedMessage)
+            if response:
+                logger.info(f"AI响应: {response}")
+                await BotClient.get_instance().send_private_message(message.user_id, response)
+                # 记录AI响应
+                await add_chat_history(
+                    content=response,
+                    user_id=message.user_id,
+                    role=MessageRole.AI
+                )
+        except Exception as e:
+            logger.error(f"处理私聊消息出错: {str(e)}")
 
 async def handle_group_message(message: GroupMessage) -> None:
     """处理群聊消息"""
@@ -48,28 +91,51 @@ async def handle_group_message(message: GroupMessage) -> None:
         return
     
     # 记录用户消息
-    add_chat_history(
+    await add_chat_history(
         content=formattedMessage.content,
         user_id=message.user_id,
         group_id=message.group_id,
         role=MessageRole.HUMAN
     )
     
-    # try:
-        # 获取AI响应
-    response = ai_handler.get_response(formattedMessage)
-    if response:
-        # 发送响应
-        await BotClient.get_instance().send_group_message(message.group_id, response)
-        # 记录AI响应
-        add_chat_history(
-            content=response,
-            user_id=message.user_id,
-            group_id=message.group_id,
-            role=MessageRole.AI
-        )
-    # except Exception as e:
-    #     logger.error(f"处理群消息出错: {str(e)}")
+    # 合并窗口期内同一用户的连续消息，窗口结束后在后台统一回复，不占用事件队列的 worker
+    group_policy = get_policy().groups.get(message.group_id)
+    if group_policy and group_policy.debounce > 0:
+        async def flush(contents: List[str]):
+            await reply_group_message(formattedMessage, "\n".join(contents))
+
+        message_coalescer.submit(formattedMessage.thread_id, formattedMessage.content, group_policy.debounce, flush)
+        return
+
+    await reply_group_message(formattedMessage, formattedMessage.content)
+
+async def reply_group_message(formattedMessage: FormattedMessage, content: str) -> None:
+    """生成并发送群聊回复"""
+    message = formattedMessage.raw
+    # 同一会话的消息串行处理，避免并发写同一个检查点；追踪从排队开始计时
+    async with (
+        tracer.turn("group", thread_id=formattedMessage.thread_id, group_id=message.group_id),
+        conversation_scheduler.serialize(formattedMessage.thread_id)
+    ):
+        # try:
+            # 获取AI响应
+        if config.stream_enabled:
+            response = await stream_group_reply(formattedMessage, content)
+        else:
+            response = await ai_handler.get_response(formattedMessage, content)
+            if response:
+                # 发送响应
+                await BotClient.get_instance().send_group_message(message.group_id, response)
+        if response:
+            # 记录AI响应
+            await add_chat_history(
+                content=response,
+                user_id=message.user_id,
+                group_id=message.group_id,
+                role=MessageRole.AI
+            )
+        # except Exception as e:
+        #     logger.error(f"处理群消息出错: {str(e)}")
 
 
 def handle_request(message: RequestReport) -> None:
@@ -82,4 +148,20 @@ def handle_notice(message: NoticeReport) -> None:
 
 def handle_meta_event(message: MetaEventReport) -> None:
     """处理元事件"""
-    logger.info(f"收到元事件: {message}") 
\ No newline at end of file
+    logger.info(f"收到元事件: {message}")
+
+async def dispatch_event(message: BasicMessage) -> None:
+    """按事件类型分发"""
+    match message:
+        case GroupMessage() as group_message:
+            await handle_group_message(group_message)
+        case PrivateMessage() as private_message:
+            await handle_private_message(private_message)
+        case RequestReport() as request_report:
+            handle_request(request_report)
+        case NoticeReport() as notice_report:
+            handle_notice(notice_report)
+        case MetaEventReport() as meta_event_report:
+            handle_meta_event(meta_event_report)
+        case _:
+            logger.warning(f"未知事件类型: {message}")
@@ -1,29 +1,30 @@
-from typing import List
 from app.model import MessageReport, PrivateMessage
-from app.config import config
+from app.policy import get_policy
 
 class FormattedMessage:
     """格式化后的消息"""
+    __slots__ = ("raw", "content", "at_list", "command")
+
     def __init__(self, raw_message: MessageReport):
         self.raw = raw_message
-        self.content = self._extract_content()
-        self.at_list = self._extract_at_list()
-    
-    def _extract_content(self) -> str:
-        """提取纯文本内容"""
+        # 一次遍历消息段，同时提取纯文本、@列表和是否为指令
         text_segments = []
-        for segment in self.raw.message:
+        at_list = []
+        for segment in raw_message.message:
             if segment.type == "text":
                 text_segments.append(segment.data["text"].strip())
-        return " ".join(text_segments).strip()
-    
-    def _extract_at_list(self) -> List[int]:
-        """提取@列表"""
-        at_list = []
-        for segment in self.raw.message:
-            if segment.type == "at":
+            elif segment.type == "at" and segment.data["qq"] != "all":
                 at_list.append(int(segment.data["qq"]))
-        return at_list
+        self.content = " ".join(text_segments).strip()
+        self.at_list = at_list
+        self.command = self.content.startswith(get_policy().command_prefix)
+    
+    @property
+    def thread_id(self) -> str:
+        """会话ID，私聊为用户ID，群聊为 用户ID-群号"""
+        if self.is_private():
+            return str(self.raw.user_id)
+        return f"{self.raw.user_id}-{self.raw.group_id}"
     
     def is_private(self) -> bool:
         """是否是私聊消息"""
@@ -31,54 +32,17 @@ class FormattedMessage:
     
     def is_command(self) -> bool:
         """是否是指令消息"""
-        return self.content.startswith(config.command_prefix)
+        return self.command
     
     def is_user_allowed(self) -> bool:
         """检查用户是否有权限使用机器人"""
-        # 如果是私聊，只检查是否在允许列表中
-        if self.is_private():
-            return self.raw.sender.user_id in config.allowed_users
-            
-        # 如果是群聊
-        group_config = config.groups.get(self.raw.group_id)
-        if group_config:
-            # 首先检查是否在群组黑名单中
-            if self.raw.sender.user_id in group_config.black_list:
-                return False
-                
-            # 如果是指令，跳过白名单检查
-            if self.is_command():
-                return True
-                
-            # 如果群组的允许用户列表为空，表示允许所有非黑名单用户
-            if not group_config.allowed_users:
-                return True
-            # 否则检查用户是否在群组的允许列表中
-            return self.raw.sender.user_id in group_config.allowed_users
-        
-        return False
+        group_id = None if self.is_private() else self.raw.group_id
+        return get_policy().is_user_allowed(self.raw.sender.user_id, group_id, self.command)
     
     def should_reply(self) -> bool:
         """检查是否需要回复此消息"""
-        # 首先检查用户权限
-        if not self.is_user_allowed():
-            return False
-            
-        # 如果是私聊，直接返回True
-        if self.is_private():
-            return True
-            
-        # 如果是指令，直接返回True
-        if self.is_command():
-            return True
-            
-        # 检查群组配置
-        group_config = config.groups.get(self.raw.group_id)
-        if group_config and group_config.at_only:
-            # 需要@且机器人在@列表中
-            return config.bot_id in self.at_list
-            
-        return True
+        group_id = None if self.is_private() else self.raw.group_id
+        return get_policy().should_reply(self.raw.sender.user_id, group_id, self.at_list, self.command)
 
 def format_message(message: MessageReport) -> FormattedMessage:
     """格式化消息"""
@@ -0,0 +1,138 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from app.policy import get_policy
+
+# Prometheus 文本格式的 Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认分桶（秒），覆盖从解析事件的微秒级到模型请求的数十秒
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def group_label(group_id: Optional[int]) -> str:
+    """群组标签，私聊为 private，未配置的群合并为 other，避免标签数量无限增长"""
+    if group_id is None:
+        return "private"
+    if group_id in get_policy().groups:
+        return str(group_id)
+    return "other"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, value in list(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value:g}")
+        return lines
+
+
+class Histogram(_Metric):
+    """分桶统计耗时
+
+    每组标签保存各桶的计数（非累计）、总和与次数，输出时再累加，observe 只做一次二分查找。
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._bounds = [f'le="{bound:g}"' for bound in self.buckets] + ['le="+Inf"']
+        # 标签 -> [各桶计数..., +Inf 桶计数, 总和]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        row = self._values.get(labels)
+        if row is None:
+            row = self._values[labels] = [0] * (len(self.buckets) + 2)
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """统计 with 块的耗时，出错时也会记录"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, row in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self._bounds, row):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {row[-1]:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    """以 Prometheus 文本格式输出所有指标"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# 指标只在事件循环线程中更新，不加锁
+
+# 事件接收
+EVENT_DECODE_SECONDS = Histogram("onebot_event_decode_seconds", "解析 OneBot 事件的耗时", ["post_type"])
+EVENT_FILTER_SECONDS = Histogram("onebot_event_filter_seconds", "按权限配置过滤事件的耗时", ["group"])
+EVENTS_TOTAL = Counter("onebot_events_total", "收到的 OneBot 事件数", ["post_type", "group", "result"])
+
+# 存储
+CHAT_HISTORY_WRITE_SECONDS = Histogram("chat_history_write_seconds", "add_chat_history 的耗时", ["group"])
+CHECKPOINT_SECONDS = Histogram("checkpoint_seconds", "读写对话检查点的耗时", ["op", "group"])
+
+# 对话
+NODE_SECONDS = Histogram("graph_node_seconds", "agent/tools 节点和对话总结的耗时", ["node", "group"])
+TOOL_SECONDS = Histogram("tool_seconds", "工具调用的耗时", ["tool", "group"])
+TOOL_ERRORS_TOTAL = Counter("tool_errors_total", "工具调用失败次数", ["tool", "group"])
+WEATHER_CACHE_TOTAL = Counter("weather_cache_lookups_total", "天气工具缓存的查询次数，cache 为 location/now/7d，result 为 hit/miss", ["cache", "result"])
+LLM_TOKENS_TOTAL = Counter("llm_tokens_total", "模型请求的 token 数，direction 为 input/output/cached", ["model", "direction", "group"])
+
+# 发送
+ONEBOT_SEND_SECONDS = Histogram("onebot_send_seconds", "调用 OneBot 发送消息的耗时（含重试）", ["kind", "group"])
+ONEBOT_SEND_FAILURES_TOTAL = Counter("onebot_send_failures_total", "发送消息失败次数", ["kind", "group"])
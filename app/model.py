@@ -1,6 +1,6 @@
-from typing import List, Literal, Optional, Union, Any
-from pydantic import BaseModel, ConfigDict, Field, model_validator
-import json
+from typing import Annotated, List, Literal, Optional, Union, Any
+from pydantic import BaseModel, ConfigDict, Discriminator, Field, Tag, TypeAdapter
+import orjson
 
 class MessageData(BaseModel):
     type: str
@@ -26,26 +26,7 @@ class BasicMessage(BaseModel):
     
     @classmethod
     def model_validate_json(cls, json_data: Union[str, bytes, bytearray]) -> Any:
-        if isinstance(json_data, (bytes, bytearray)):
-            data = json.loads(json_data.decode())
-        else:
-            data = json.loads(json_data)
-            
-        post_type = data.get('post_type')
-        message_type = data.get('message_type')
-        
-        if post_type == 'message' and message_type == 'group':
-            return GroupMessage.model_validate(data)
-        elif post_type == 'message' and message_type == 'private':
-            return PrivateMessage.model_validate(data)
-        elif post_type == 'request':
-            return RequestReport.model_validate(data)
-        elif post_type == 'notice':
-            return NoticeReport.model_validate(data)
-        elif post_type == 'meta_event':
-            return MetaEventReport.model_validate(data)
-        
-        return cls.model_validate(data)
+        return decode_event(json_data)
 
 class MessageReport(BasicMessage):
     message_type: Literal["group", "private"]
@@ -72,4 +53,45 @@ class GroupMessage(MessageReport):
 
 class PrivateMessage(MessageReport):
     target_id: Optional[int] = None
-    temp_source: Optional[int] = None
\ No newline at end of file
+    temp_source: Optional[int] = None
+
+def event_tag(value: Any) -> str:
+    """根据 post_type 和 message_type 选择事件模型"""
+    if isinstance(value, dict):
+        post_type = value.get("post_type")
+        message_type = value.get("message_type")
+    else:
+        post_type = getattr(value, "post_type", None)
+        message_type = getattr(value, "message_type", None)
+    if post_type == "message":
+        if message_type in ("group", "private"):
+            return message_type
+        return "other"
+    if post_type in ("request", "notice", "meta_event"):
+        return post_type
+    return "other"
+
+Event = Annotated[
+    Union[
+        Annotated[GroupMessage, Tag("group")],
+        Annotated[PrivateMessage, Tag("private")],
+        Annotated[RequestReport, Tag("request")],
+        Annotated[NoticeReport, Tag("notice")],
+        Annotated[MetaEventReport, Tag("meta_event")],
+        Annotated[BasicMessage, Tag("other")],
+    ],
+    Discriminator(event_tag),
+]
+
+event_adapter = TypeAdapter(Event)
+
+def decode_event(json_data: Union[str, bytes, bytearray]) -> BasicMessage:
+    """解析 OneBot 事件
+
+    orjson 解析后由带标签的联合类型直接选择对应模型校验，只解析、校验一次。
+    """
+    return validate_event(orjson.loads(json_data))
+
+def validate_event(data: dict) -> BasicMessage:
+    """校验已解析的 OneBot 事件字典"""
+    return event_adapter.validate_python(data)
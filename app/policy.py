@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+from app.config import Settings, config, load_config
+
+logger = logging.getLogger("uvicorn")
+
+CONFIG_PATH = "config.toml"
+
+
+class GroupPolicy:
+    """编译后的群组配置"""
+    __slots__ = ("at_only", "allowed_users", "black_list", "debounce")
+
+    def __init__(self, at_only: bool, allowed_users: FrozenSet[int], black_list: FrozenSet[int], debounce: float):
+        self.at_only = at_only
+        self.allowed_users = allowed_users
+        self.black_list = black_list
+        self.debounce = debounce
+
+
+class PolicySnapshot:
+    """回复权限配置的只读快照
+
+    用户列表编译为 frozenset，热加载时整体替换快照，处理中的消息始终看到一致的配置。
+    """
+    __slots__ = ("bot_id", "command_prefix", "allowed_users", "groups")
+
+    def __init__(self, settings: Settings):
+        self.bot_id = settings.bot_id
+        self.command_prefix = settings.command_prefix
+        self.allowed_users = frozenset(settings.allowed_users)
+        self.groups: Dict[int, GroupPolicy] = {
+            group_id: GroupPolicy(
+                at_only=group.at_only,
+                allowed_users=frozenset(group.allowed_users),
+                black_list=frozenset(group.black_list),
+                debounce=group.debounce
+            )
+            for group_id, group in settings.groups.items()
+        }
+
+    def is_user_allowed(self, user_id: int, group_id: Optional[int], is_command: bool) -> bool:
+        """检查用户是否有权限使用机器人"""
+        # 如果是私聊，只检查是否在允许列表中
+        if group_id is None:
+            return user_id in self.allowed_users
+
+        group = self.groups.get(group_id)
+        if group is None:
+            return False
+        # 首先检查是否在群组黑名单中
+        if user_id in group.black_list:
+            return False
+        # 如果是指令，或群组的允许用户列表为空，允许所有非黑名单用户
+        if is_command or not group.allowed_users:
+            return True
+        return user_id in group.allowed_users
+
+    def should_reply(self, user_id: int, group_id: Optional[int], at_list: List[int], is_command: bool) -> bool:
+        """检查是否需要回复此消息"""
+        if not self.is_user_allowed(user_id, group_id, is_command):
+            return False
+        # 私聊和指令直接回复
+        if group_id is None or is_command:
+            return True
+        # 需要@且机器人在@列表中
+        if self.groups[group_id].at_only:
+            return self.bot_id in at_list
+        return True
+
+    def accepts(self, event: Dict[str, Any]) -> bool:
+        """在构建模型之前用原始事件字典判断是否需要处理
+
+        心跳等元事件、未配置群的通知和不需要回复的消息直接丢弃；
+        字段缺失或格式不符时放行，交给模型校验报错。
+        """
+        post_type = event.get("post_type")
+        if post_type == "meta_event":
+            return False
+        group_id = event.get("group_id")
+        if group_id is not None and group_id not in self.groups:
+            return False
+        if post_type != "message":
+            return True
+
+        message_type = event.get("message_type")
+        segments = event.get("message")
+        user_id = event.get("user_id")
+        if message_type not in ("group", "private") or not isinstance(segments, list):
+            return True
+        try:
+            content, at_list = extract_segments(segments)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return True
+        return self.should_reply(
+            user_id,
+            group_id if message_type == "group" else None,
+            at_list,
+            content.startswith(self.command_prefix)
+        )
+
+
+def extract_segments(segments: List[Dict[str, Any]]) -> Tuple[str, List[int]]:
+    """从原始消息段中提取纯文本和@列表，与 FormattedMessage 的规则一致"""
+    text_segments = []
+    at_list = []
+    for segment in segments:
+        segment_type = segment.get("type")
+        if segment_type == "text":
+            text_segments.append(segment["data"]["text"].strip())
+        elif segment_type == "at":
+            qq = segment["data"]["qq"]
+            # @全体成员 的 qq 为 "all"
+            if qq != "all":
+                at_list.append(int(qq))
+    return " ".join(text_segments).strip(), at_list
+
+
+_snapshot = PolicySnapshot(config)
+
+
+def get_policy() -> PolicySnapshot:
+    """获取当前的配置快照"""
+    return _snapshot
+
+
+def reload_policy() -> PolicySnapshot:
+    """重新读取 config.toml 并替换配置快照"""
+    global _snapshot
+    _snapshot = PolicySnapshot(load_config())
+    return _snapshot
+
+
+class PolicyWatcher:
+    """监视 config.toml 的修改时间，变化后重新加载用户和群组配置"""
+    def __init__(self, interval: float, path: str = CONFIG_PATH):
+        self.interval = interval
+        self.path = path
+        self._mtime = self._stat()
+        self._task: Optional[asyncio.Task] = None
+
+    def _stat(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run(), name="policy-watcher")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            mtime = self._stat()
+            if mtime is None or mtime == self._mtime:
+                continue
+            self._mtime = mtime
+            try:
+                snapshot = await asyncio.to_thread(reload_policy)
+                logger.info(f"已重新加载配置: {len(snapshot.groups)} 个群组, {len(snapshot.allowed_users)} 个私聊用户")
+            except Exception as e:
+                # 配置文件有误时保留旧快照
+                logger.error(f"重新加载配置失败: {str(e)}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+# 创建全局实例
+policy_watcher = PolicyWatcher(config.policy_reload_interval)
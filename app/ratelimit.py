@@ -0,0 +1,59 @@
+import asyncio
+import time
+from app.cache import TTLCache
+
+
+class TokenBucket:
+    """令牌桶
+
+    以 rate 个/秒的速度补充令牌，最多积累 capacity 个。
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """令牌足够时立即扣除并返回True，否则返回False"""
+        # 单次请求超过容量时，等桶满即可放行，避免永远等待
+        tokens = min(tokens, self.capacity)
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1.0) -> float:
+        """距离令牌足够还需等待的秒数"""
+        tokens = min(tokens, self.capacity)
+        self._refill()
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1.0):
+        """等待直到获取到令牌"""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
+
+
+class GroupRateLimiter:
+    """按群限制发送频率，不活跃的群的令牌桶会被淘汰"""
+    def __init__(self, interval: float, maxsize: int = 4096, capacity: float = 1):
+        self.interval = interval
+        self.capacity = capacity
+        self._buckets = TTLCache(maxsize=maxsize, ttl=max(interval * 10, 60))
+
+    def get_bucket(self, group_id: int) -> TokenBucket:
+        bucket = self._buckets.get(group_id)
+        if bucket is None:
+            bucket = TokenBucket(rate=1 / self.interval if self.interval > 0 else 1e9, capacity=self.capacity)
+        # 每次使用都刷新过期时间
+        self._buckets.set(group_id, bucket)
+        return bucket
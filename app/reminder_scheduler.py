@@ -0,0 +1,174 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from apscheduler.triggers.cron import CronTrigger
+from app.sql.models import Reminder
+from app.sql.reminders import add_reminders, delete_reminders, load_reminders, reschedule_reminders
+
+logger = logging.getLogger("uvicorn")
+
+
+@lru_cache(maxsize=1024)
+def parse_cron(expression: str) -> CronTrigger:
+    """解析 crontab 表达式（分 时 日 月 周），按本地时区计算，表达式无效时抛出 ValueError"""
+    return CronTrigger.from_crontab(expression)
+
+
+def next_fire_time(reminder: Reminder, now: float) -> Optional[float]:
+    """重复提醒的下次触发时间，一次性提醒返回 None
+
+    停机期间错过的触发不补发，直接计算 now 之后的下一次。
+    """
+    if reminder.interval:
+        fire_at = reminder.fire_at + reminder.interval
+        if fire_at <= now:
+            fire_at += ((now - fire_at) // reminder.interval + 1) * reminder.interval
+        return fire_at
+    if reminder.cron:
+        trigger = parse_cron(reminder.cron)
+        # 批量触发可能提前 batch_window 秒，从本次触发时间之后开始计算，避免同一分钟重复触发
+        after = datetime.fromtimestamp(max(now, reminder.fire_at) + 1, trigger.timezone)
+        next_time = trigger.get_next_fire_time(None, after)
+        return next_time.timestamp() if next_time else None
+    return None
+
+
+class ReminderScheduler:
+    """定时提醒调度器
+
+    提醒保存在 reminders 表中，启动时一次性加载到内存最小堆里，
+    后台任务只在堆顶提醒到期或有更早的提醒加入时被唤醒，不轮询数据库。
+    同时到期（相差不超过 batch_window 秒）的提醒作为一批触发，触发后一次性提醒批量删除，
+    重复提醒批量更新下次触发时间并重新入堆。
+    """
+    def __init__(self, fire: Callable[[List[Reminder]], Awaitable[None]], batch_window: float = 0.5):
+        self._fire = fire
+        self.batch_window = batch_window
+        # (触发时间, 提醒ID)，取消的提醒只从 _reminders 中删除，出堆时跳过
+        self._heap: List[Tuple[float, str]] = []
+        self._reminders: Dict[str, Reminder] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._firing: Set[asyncio.Task] = set()
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def __len__(self) -> int:
+        return len(self._reminders)
+
+    def start(self, before_load: Optional[Callable[[], None]] = None):
+        """启动后台任务
+
+        Args:
+            before_load: 加载提醒前在线程中执行的函数，用于迁移旧数据
+        """
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(before_load), name="reminder-scheduler")
+
+    async def add(self, reminders: List[Reminder]):
+        """保存并调度一批提醒"""
+        await asyncio.to_thread(add_reminders, reminders)
+        self._schedule(reminders)
+
+    async def remove(self, ids: Iterable[str]):
+        """取消提醒"""
+        ids = list(ids)
+        for id in ids:
+            self._reminders.pop(id, None)
+        await asyncio.to_thread(delete_reminders, ids)
+
+    def pending(self) -> List[Reminder]:
+        """所有未触发的提醒，按触发时间排序"""
+        return sorted(self._reminders.values(), key=lambda r: r.fire_at)
+
+    def _schedule(self, reminders: Iterable[Reminder]):
+        earliest = self._heap[0][0] if self._heap else None
+        for reminder in reminders:
+            if reminder.id in self._reminders:
+                continue
+            self._reminders[reminder.id] = reminder
+            heapq.heappush(self._heap, (reminder.fire_at, reminder.id))
+        if self._heap and (earliest is None or self._heap[0][0] < earliest):
+            self._wakeup.set()
+
+    def _pop_due(self, deadline: float) -> List[Reminder]:
+        batch = []
+        while self._heap and self._heap[0][0] <= deadline:
+            _, id = heapq.heappop(self._heap)
+            reminder = self._reminders.pop(id, None)
+            if reminder is not None:
+                batch.append(reminder)
+        return batch
+
+    async def _run(self, before_load: Optional[Callable[[], None]]):
+        try:
+            if before_load is not None:
+                await asyncio.to_thread(before_load)
+            reminders = await asyncio.to_thread(load_reminders)
+            self._schedule(reminders)
+            logger.info(f"已加载 {len(reminders)} 条定时提醒")
+        except Exception as e:
+            logger.error(f"加载定时提醒失败: {str(e)}")
+
+        while not self._stopping:
+            self._wakeup.clear()
+            delay = self._heap[0][0] - time.time() if self._heap else None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            batch = self._pop_due(time.time() + self.batch_window)
+            if batch:
+                # 发送可能因限速等待，放到单独的任务中，不耽误后续提醒
+                task = asyncio.create_task(self._fire_batch(batch))
+                self._firing.add(task)
+                task.add_done_callback(self._firing.discard)
+
+    async def _fire_batch(self, batch: List[Reminder]):
+        # 先安排重复提醒的下一次触发，发送期间也可以被查询和取消
+        now = time.time()
+        finished, rescheduled = [], []
+        for reminder in batch:
+            fire_at = next_fire_time(reminder, now)
+            if fire_at is None:
+                finished.append(reminder.id)
+            else:
+                reminder.fire_at = fire_at
+                rescheduled.append(reminder)
+        self._schedule(rescheduled)
+
+        try:
+            await self._fire(batch)
+        except Exception as e:
+            logger.error(f"触发定时提醒失败: {str(e)}")
+
+        try:
+            await asyncio.to_thread(delete_reminders, finished)
+            await asyncio.to_thread(
+                reschedule_reminders,
+                [(r.id, r.fire_at) for r in rescheduled if r.id in self._reminders]
+            )
+        except Exception as e:
+            logger.error(f"更新已触发的定时提醒失败: {str(e)}")
+
+    async def stop(self):
+        """停止调度，等待正在发送的提醒完成"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        if self._firing:
+            await asyncio.gather(*self._firing, return_exceptions=True)
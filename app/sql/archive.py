@@ -0,0 +1,195 @@
+import asyncio
+import glob
+import logging
+import os
+import sqlite3
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlmodel import delete, select
+from app.config import config
+from app.sql.client import db_client
+from app.sql.models import ChatHistory, MessageRole, MessageType
+
+logger = logging.getLogger("uvicorn")
+
+# 归档库与热表使用相同的访问路径，内容使用 zlib 压缩
+ARCHIVE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS chat_history (
+        id INTEGER PRIMARY KEY,
+        created_at TEXT NOT NULL,
+        content BLOB NOT NULL,
+        user_id INTEGER NOT NULL,
+        group_id INTEGER,
+        role TEXT NOT NULL,
+        type TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_chat_history_user_group_created ON chat_history (user_id, group_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_chat_history_group_created ON chat_history (group_id, created_at, id)",
+]
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+def _archive_path(month: str) -> str:
+    return os.path.join(config.archive_dir, f"chat-{month}.db")
+
+def _list_months() -> List[str]:
+    """已存在的归档月份，从新到旧"""
+    paths = glob.glob(os.path.join(config.archive_dir, "chat-*.db"))
+    return sorted((os.path.basename(p)[len("chat-"):-len(".db")] for p in paths), reverse=True)
+
+def _connect(month: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(_archive_path(month))
+    for statement in ARCHIVE_SCHEMA:
+        conn.execute(statement)
+    return conn
+
+def archive_chat_history(older_than: datetime, batch_size: int = 5000) -> int:
+    """将早于 older_than 的聊天记录移入按月分库的归档数据库
+
+    先写入并提交归档库，再从热表删除，中途失败重跑时按主键去重，不会丢失数据。
+
+    Args:
+        older_than: 归档此时间之前的记录
+        batch_size: 每批处理的记录数
+
+    Returns:
+        int: 归档的记录数
+    """
+    os.makedirs(config.archive_dir, exist_ok=True)
+    total = 0
+    while True:
+        # 旧记录集中在主键前部，按主键顺序扫描无需额外索引
+        with db_client.get_session() as session:
+            rows = session.exec(
+                select(ChatHistory)
+                .where(ChatHistory.created_at < older_than)
+                .order_by(ChatHistory.id)
+                .limit(batch_size)
+            ).all()
+        if not rows:
+            break
+
+        by_month: Dict[str, List[ChatHistory]] = defaultdict(list)
+        for row in rows:
+            by_month[row.created_at.strftime("%Y-%m")].append(row)
+
+        for month, month_rows in by_month.items():
+            conn = _connect(month)
+            try:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO chat_history (id, created_at, content, user_id, group_id, role, type) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(
+                        row.id,
+                        row.created_at.strftime(TIME_FORMAT),
+                        zlib.compress(row.content.encode()),
+                        row.user_id,
+                        row.group_id,
+                        MessageRole(row.role).value,
+                        MessageType(row.type).value
+                    ) for row in month_rows]
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+        with db_client.get_write_session() as session:
+            session.exec(delete(ChatHistory).where(ChatHistory.id.in_([row.id for row in rows])))
+            session.commit()
+        total += len(rows)
+
+    return total
+
+def read_archived_history(
+    group_id: Optional[int],
+    limit: int,
+    user_id: Optional[int] = None,
+    role: Optional[MessageRole] = None,
+    message_type: Optional[MessageType] = None,
+    before: Optional[Tuple[datetime, int]] = None
+) -> List[ChatHistory]:
+    """从归档库按月倒序读取最近的 limit 条记录，返回时间正序
+
+    user_id 为 None 时按群组查询，否则按用户+群组查询。
+    """
+    conditions = ["group_id IS ?"]
+    params: list = [group_id]
+    if user_id is not None:
+        conditions.insert(0, "user_id = ?")
+        params.insert(0, user_id)
+    if role:
+        conditions.append("role = ?")
+        params.append(MessageRole(role).value)
+    if message_type:
+        conditions.append("type = ?")
+        params.append(MessageType(message_type).value)
+    if before:
+        conditions.append("(created_at, id) < (?, ?)")
+        params += [before[0].strftime(TIME_FORMAT), before[1]]
+
+    sql = (
+        "SELECT id, created_at, content, user_id, group_id, role, type FROM chat_history "
+        f"WHERE {' AND '.join(conditions)} ORDER BY created_at DESC, id DESC LIMIT ?"
+    )
+
+    result: List[ChatHistory] = []
+    before_month = before[0].strftime("%Y-%m") if before else None
+    for month in _list_months():
+        if before_month and month > before_month:
+            continue
+        conn = sqlite3.connect(_archive_path(month))
+        try:
+            rows = conn.execute(sql, params + [limit - len(result)]).fetchall()
+        finally:
+            conn.close()
+        for id, created_at, content, row_user_id, row_group_id, row_role, row_type in rows:
+            result.append(ChatHistory(
+                id=id,
+                created_at=datetime.strptime(created_at, TIME_FORMAT),
+                content=zlib.decompress(content).decode(),
+                user_id=row_user_id,
+                group_id=row_group_id,
+                role=MessageRole(row_role),
+                type=MessageType(row_type)
+            ))
+        if len(result) >= limit:
+            break
+
+    result.reverse()
+    return result
+
+class ChatHistoryArchiver:
+    """定期归档过期聊天记录的后台任务"""
+    def __init__(self, retention_days: int, interval_hours: float):
+        self.retention_days = retention_days
+        self.interval_hours = interval_hours
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="chat-history-archiver")
+
+    async def _run(self):
+        while True:
+            cutoff = datetime.now() - timedelta(days=self.retention_days)
+            try:
+                count = await asyncio.to_thread(archive_chat_history, cutoff)
+                if count:
+                    logger.info(f"已归档 {count} 条 {cutoff:%Y-%m-%d} 之前的聊天记录")
+            except Exception as e:
+                logger.error(f"归档聊天记录失败: {str(e)}")
+            await asyncio.sleep(self.interval_hours * 3600)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+# 创建全局实例
+history_archiver = ChatHistoryArchiver(
+    retention_days=config.archive_retention_days,
+    interval_hours=config.archive_interval_hours
+)
@@ -1,10 +1,96 @@
+import asyncio
+import logging
+from app.config import config
+from app.metrics import CHAT_HISTORY_WRITE_SECONDS, group_label
+from app.tracing import span
+from app.sql.archive import read_archived_history
 from app.sql.client import db_client
 from app.sql.models import ChatHistory, MessageRole, MessageType
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from datetime import datetime
+from sqlalchemy import tuple_
 from sqlmodel import select
 
-def add_chat_history(
+logger = logging.getLogger("uvicorn")
+
+def _write_batch(records: List[ChatHistory]):
+    """在一个事务中写入一批聊天记录"""
+    with db_client.get_write_session() as session:
+        session.add_all(records)
+        session.commit()
+
+class ChatHistoryWriter:
+    """聊天记录写缓冲
+
+    add_chat_history 只把记录放入内存缓冲区，由后台任务在缓冲区达到 batch_size
+    或距上次写入超过 flush_interval 秒时批量提交，关闭时写入剩余记录。
+    进程异常退出时最多丢失一个刷新周期内的记录。
+    """
+    def __init__(self, batch_size: int, flush_interval: float, max_pending: int = 10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._buffer: List[ChatHistory] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        """启动后台刷新任务"""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run(), name="chat-history-writer")
+
+    def add(self, record: ChatHistory):
+        """加入缓冲区"""
+        self._buffer.append(record)
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """将缓冲区中的记录写入数据库"""
+        async with self._flush_lock:
+            batch, self._buffer = self._buffer, []
+            if not batch:
+                return
+            try:
+                await asyncio.to_thread(_write_batch, batch)
+            except Exception as e:
+                logger.error(f"批量写入聊天记录失败: {str(e)}")
+                # 放回缓冲区等待下次重试，超出上限时丢弃最旧的记录
+                self._buffer = (batch + self._buffer)[-self.max_pending:]
+
+    async def stop(self):
+        """停止后台任务并写入剩余记录"""
+        if self._task is not None:
+            # 通知后台任务退出而不是取消，避免打断正在进行的批量写入
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+# 创建全局实例
+history_writer = ChatHistoryWriter(
+    batch_size=config.history_batch_size,
+    flush_interval=config.history_flush_interval
+)
+
+async def add_chat_history(
     content: str,
     user_id: int,
     role: MessageRole = MessageRole.HUMAN,
@@ -12,6 +98,8 @@ def add_chat_history(
     group_id: Optional[int] = None
 ) -> ChatHistory:
     """添加聊天记录
+
+    sync 模式下在线程中提交，等待写锁时不阻塞事件循环（检查点的异步连接也要在事件循环中提交才能释放写锁）
     
     Args:
         content: 聊天内容
@@ -21,9 +109,9 @@ def add_chat_history(
         group_id: 群组ID,私聊为None
         
     Returns:
-        ChatHistory: 创建的聊天记录
+        ChatHistory: 创建的聊天记录，启用写缓冲时尚未写入数据库
     """
-    with db_client.get_session() as session:
+    with CHAT_HISTORY_WRITE_SECONDS.time(group_label(group_id)), span("history.write", role=role.value):
         chat_history = ChatHistory(
             content=content,
             user_id=user_id,
@@ -32,18 +120,41 @@ def add_chat_history(
             type=message_type,
             created_at=datetime.now()
         )
-        session.add(chat_history)
-        session.commit()
+        if history_writer.running:
+            history_writer.add(chat_history)
+            return chat_history
+
+        await asyncio.to_thread(_write_batch, [chat_history])
         return chat_history
 
+# 分页游标: 上一页第一条（最早）记录的 (created_at, id)
+HistoryCursor = Tuple[datetime, int]
+
+def history_cursor(record: ChatHistory) -> HistoryCursor:
+    """根据记录生成分页游标，传给 before 参数获取更早的一页"""
+    return (record.created_at, record.id)
+
+def _query_latest(query, limit: int, before: Optional[HistoryCursor]) -> List[ChatHistory]:
+    """按 (created_at, id) 倒序走索引取最近的 limit 条，返回时恢复为时间正序"""
+    if before:
+        query = query.where(tuple_(ChatHistory.created_at, ChatHistory.id) < tuple_(*before))
+    query = query.order_by(ChatHistory.created_at.desc(), ChatHistory.id.desc()).limit(limit)
+
+    with db_client.get_session() as session:
+        result = session.exec(query).all()
+    result.reverse()
+    return result
+
 def get_user_history(
     user_id: int,
     group_id: Optional[int] = None,
     limit: int = 10,
     role: Optional[MessageRole] = None,
-    message_type: Optional[MessageType] = None
+    message_type: Optional[MessageType] = None,
+    before: Optional[HistoryCursor] = None,
+    include_archive: bool = False
 ) -> List[ChatHistory]:
-    """获取用户的聊天历史
+    """获取用户最近的聊天历史
     
     Args:
         user_id: 用户ID
@@ -51,54 +162,66 @@ def get_user_history(
         limit: 返回的记录数量
         role: 筛选特定角色的消息
         message_type: 筛选特定类型的消息
+        before: 分页游标，只返回早于该游标的记录
+        include_archive: 热表中记录不足时继续从归档库读取
         
     Returns:
-        List[ChatHistory]: 聊天记录列表
+        List[ChatHistory]: 聊天记录列表，按时间正序
     """
-    with db_client.get_session() as session:
-        query = select(ChatHistory).where(
-            ChatHistory.user_id == user_id,
-            ChatHistory.group_id == group_id
-        )
-        
-        if role:
-            query = query.where(ChatHistory.role == role)
-        if message_type:
-            query = query.where(ChatHistory.type == message_type)
-            
-        query = query.order_by(ChatHistory.created_at.asc()).limit(limit)
+    query = select(ChatHistory).where(
+        ChatHistory.user_id == user_id,
+        ChatHistory.group_id == group_id
+    )
+    
+    if role:
+        query = query.where(ChatHistory.role == role)
+    if message_type:
+        query = query.where(ChatHistory.type == message_type)
         
-        result = session.exec(query)
-        return result.all()
+    result = _query_latest(query, limit, before)
+    if include_archive and len(result) < limit:
+        older = read_archived_history(
+            group_id, limit - len(result), user_id=user_id, role=role, message_type=message_type,
+            before=history_cursor(result[0]) if result else before
+        )
+        result = older + result
+    return result
 
 def get_group_history(
     group_id: int,
     limit: int = 10,
     role: Optional[MessageRole] = None,
-    message_type: Optional[MessageType] = None
+    message_type: Optional[MessageType] = None,
+    before: Optional[HistoryCursor] = None,
+    include_archive: bool = False
 ) -> List[ChatHistory]:
-    """获取群组的聊天历史
+    """获取群组最近的聊天历史
     
     Args:
         group_id: 群组ID
         limit: 返回的记录数量
         role: 筛选特定角色的消息
         message_type: 筛选特定类型的消息
+        before: 分页游标，只返回早于该游标的记录
+        include_archive: 热表中记录不足时继续从归档库读取
         
     Returns:
-        List[ChatHistory]: 聊天记录列表
+        List[ChatHistory]: 聊天记录列表，按时间正序
     """
-    with db_client.get_session() as session:
-        query = select(ChatHistory).where(
-            ChatHistory.group_id == group_id
-        )
-        
-        if role:
-            query = query.where(ChatHistory.role == role)
-        if message_type:
-            query = query.where(ChatHistory.type == message_type)
-            
-        query = query.order_by(ChatHistory.created_at.asc()).limit(limit)
+    query = select(ChatHistory).where(
+        ChatHistory.group_id == group_id
+    )
+    
+    if role:
+        query = query.where(ChatHistory.role == role)
+    if message_type:
+        query = query.where(ChatHistory.type == message_type)
         
-        result = session.exec(query)
-        return result.all() 
\ No newline at end of file
+    result = _query_latest(query, limit, before)
+    if include_archive and len(result) < limit:
+        older = read_archived_history(
+            group_id, limit - len(result), role=role, message_type=message_type,
+            before=history_cursor(result[0]) if result else before
+        )
+        result = older + result
+    return result
@@ -1,30 +1,80 @@
 from contextlib import contextmanager
+from typing import List
+import aiosqlite
+from sqlalchemy import event, inspect, text
 from sqlmodel import SQLModel, create_engine, Session
+from app.config import config
+
+def get_pragmas() -> List[str]:
+    """每个连接建立时执行的 PRAGMA"""
+    return [
+        # WAL 模式下读不阻塞写，写也不阻塞读（对数据库文件持久生效）
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=" + config.sqlite_synchronous,
+        f"PRAGMA busy_timeout={config.sqlite_busy_timeout}",
+        f"PRAGMA mmap_size={config.sqlite_mmap_size}",
+        f"PRAGMA cache_size={config.sqlite_cache_size}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+def _set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in get_pragmas():
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
 
 class SQLiteClient:
-    """SQLite客户端"""
+    """SQLite客户端
+
+    聊天记录、提醒等写操作统一通过只有一个连接的写引擎串行执行，读操作使用连接池，
+    配合 WAL 模式避免 "database is locked"。LangGraph 检查点使用单独的异步连接写入（见 get_async_conn）。
+    """
     _instance = None
     _initialized = False
-    url = "sqlite:///.data/chat.db"
-    
+    path = ".data/chat.db"
+    url = f"sqlite:///{path}"
+
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
-    
+
     def __init__(self):
         if not SQLiteClient._initialized:
-            # 创建引擎
+            # 读引擎，WAL 模式下多个读连接可以并发
             self.engine = create_engine(
                 self.url,
                 connect_args={"check_same_thread": False},
+                pool_size=config.sqlite_read_pool_size,
+                max_overflow=0,
                 echo=False  # 设置为True可以看到SQL语句,
             )
-            
+            # 写引擎，只有一个连接，其他写入方在连接池上排队
+            self.write_engine = create_engine(
+                self.url,
+                connect_args={"check_same_thread": False},
+                pool_size=1,
+                max_overflow=0,
+                pool_timeout=60,
+                echo=False
+            )
+            event.listen(self.engine, "connect", _set_pragmas)
+            event.listen(self.write_engine, "connect", _set_pragmas)
+
             SQLiteClient._initialized = True
-    
-    def get_conn(self):
-        return self.engine.raw_connection()
+
+    async def get_async_conn(self) -> aiosqlite.Connection:
+        """获取异步数据库连接（供 LangGraph 异步检查点使用）
+
+        AsyncSqliteSaver 需要自己的 aiosqlite 连接，检查点写入不经过写引擎，
+        与写引擎是同一数据库的两个写入方，靠 WAL 模式和 busy_timeout 等待对方的写锁。
+        """
+        conn = await aiosqlite.connect(self.path)
+        for pragma in get_pragmas():
+            await conn.execute(pragma)
+        return conn
 
     @classmethod
     def get_instance(cls) -> 'SQLiteClient':
@@ -32,10 +82,10 @@ class SQLiteClient:
         if cls._instance is None:
             cls._instance = SQLiteClient()
         return cls._instance
-    
+
     @contextmanager
     def get_session(self):
-        """获取数据库会话"""
+        """获取只读数据库会话"""
         with Session(self.engine) as session:
             try:
                 yield session
@@ -45,14 +95,43 @@ class SQLiteClient:
             finally:
                 session.close()
 
+    @contextmanager
+    def get_write_session(self):
+        """获取写数据库会话，所有写入共享同一个连接"""
+        with Session(self.write_engine) as session:
+            try:
+                yield session
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
     def create_db_and_tables(self):
-        """创建数据库和表"""
-        SQLModel.metadata.create_all(self.engine)
-    
+        """创建数据库和表，已存在的表补充新增的可空列和索引"""
+        SQLModel.metadata.create_all(self.write_engine)
+        with self.write_engine.begin() as conn:
+            for table in SQLModel.metadata.sorted_tables:
+                existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing and column.nullable:
+                        column_type = column.type.compile(dialect=conn.dialect)
+                        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+
+    def drop_indexes(self, *names: str):
+        """删除不再使用的索引"""
+        with self.write_engine.begin() as conn:
+            for name in names:
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
     def close(self):
         """关闭数据库连接"""
         if self.engine:
             self.engine.dispose()
+        if self.write_engine:
+            self.write_engine.dispose()
 
 # 创建全局实例
-db_client = SQLiteClient.get_instance()
\ No newline at end of file
+db_client = SQLiteClient.get_instance()
@@ -1,4 +1,6 @@
 from datetime import datetime
+from typing import Optional
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 from enum import Enum
 from app.sql.client import db_client
@@ -16,16 +18,42 @@ class MessageType(str, Enum):
 class ChatHistory(SQLModel, table=True):
     """聊天历史记录表"""
     __tablename__ = 'chat_history'
+    __table_args__ = (
+        # 对应 get_user_history / get_group_history 的过滤条件和排序
+        Index("ix_chat_history_user_group_created", "user_id", "group_id", "created_at", "id"),
+        Index("ix_chat_history_group_created", "group_id", "created_at", "id"),
+    )
     
     id: int = Field(default=None, primary_key=True)
     created_at: datetime = Field(default=datetime.now, nullable=False)
     content: str = Field(nullable=False)
-    user_id: int = Field(nullable=False, index=True)
-    group_id: int = Field(nullable=True, index=True)
+    user_id: int = Field(nullable=False)
+    group_id: int = Field(nullable=True)
     role: MessageRole = Field(nullable=False, default=MessageRole.HUMAN)
     type: MessageType = Field(nullable=False, default=MessageType.MESSAGE)
     
     def __repr__(self):
         return f"<ChatHistory(id={self.id}, user_id={self.user_id}, group_id={self.group_id}, role={self.role}, type={self.type})>"
 
-db_client.create_db_and_tables()
\ No newline at end of file
+class Reminder(SQLModel, table=True):
+    """定时提醒表"""
+    __tablename__ = 'reminders'
+    __table_args__ = (
+        # 对应 list_timers / cancel_timer 按用户和会话查询
+        Index("ix_reminders_user_group", "user_id", "group_id", "fire_at"),
+    )
+
+    id: str = Field(primary_key=True)  # uuid4 十六进制字符串
+    fire_at: float = Field(nullable=False, index=True)  # 下次触发时间（Unix 时间戳）
+    user_id: int = Field(nullable=False)
+    group_id: Optional[int] = Field(default=None, nullable=True)  # 为空时发送私聊提醒
+    message: str = Field(nullable=False)
+    cron: Optional[str] = Field(default=None, nullable=True)  # 重复提醒的 crontab 表达式
+    interval: Optional[int] = Field(default=None, nullable=True)  # 重复提醒的间隔（秒）
+
+    def __repr__(self):
+        return f"<Reminder(id={self.id}, fire_at={self.fire_at}, user_id={self.user_id}, group_id={self.group_id})>"
+
+db_client.create_db_and_tables()
+# 旧的单列索引已被复合索引覆盖
+db_client.drop_indexes("ix_chat_history_user_id", "ix_chat_history_group_id")
\ No newline at end of file
@@ -0,0 +1,55 @@
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy import bindparam, insert, update
+from sqlmodel import delete, select
+from app.sql.client import db_client
+from app.sql.models import Reminder
+
+def add_reminders(reminders: List[Reminder]):
+    """在一个事务中保存一批提醒
+
+    使用批量 INSERT，传入的对象不绑定到会话，之后仍可在内存中使用。
+    """
+    if not reminders:
+        return
+    with db_client.get_write_session() as session:
+        session.execute(insert(Reminder), [reminder.model_dump() for reminder in reminders])
+        session.commit()
+
+def load_reminders() -> List[Reminder]:
+    """按触发时间读取所有未触发的提醒"""
+    with db_client.get_session() as session:
+        return list(session.exec(select(Reminder).order_by(Reminder.fire_at)).all())
+
+def delete_reminders(ids: Iterable[str]):
+    """删除已触发的提醒"""
+    ids = list(ids)
+    if not ids:
+        return
+    with db_client.get_write_session() as session:
+        session.exec(delete(Reminder).where(Reminder.id.in_(ids)))
+        session.commit()
+
+def reschedule_reminders(updates: List[Tuple[str, float]]):
+    """批量更新重复提醒的下次触发时间
+
+    Args:
+        updates: (提醒ID, 下次触发时间) 列表
+    """
+    if not updates:
+        return
+    table = Reminder.__table__
+    with db_client.get_write_session() as session:
+        session.execute(
+            update(table).where(table.c.id == bindparam("reminder_id")).values(fire_at=bindparam("next_fire_at")),
+            [{"reminder_id": id, "next_fire_at": fire_at} for id, fire_at in updates]
+        )
+        session.commit()
+
+def list_reminders(user_id: int, group_id: Optional[int]) -> List[Reminder]:
+    """按触发时间读取用户在某个群（或私聊）中设置的提醒"""
+    with db_client.get_session() as session:
+        return list(session.exec(
+            select(Reminder)
+            .where(Reminder.user_id == user_id, Reminder.group_id == group_id)
+            .order_by(Reminder.fire_at)
+        ).all())
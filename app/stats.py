@@ -0,0 +1,10 @@
+import math
+from typing import Sequence
+
+
+def percentile(ordered: Sequence[float], pct: float) -> float:
+    """计算已排序数据的百分位数（最近秩法），pct 取 0-100，没有数据时返回0"""
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
@@ -0,0 +1,224 @@
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+import orjson
+from langchain_core.callbacks import BaseCallbackHandler
+from app.config import config
+
+logger = logging.getLogger("uvicorn")
+
+
+class Span:
+    """一次操作的耗时"""
+    __slots__ = ("name", "start", "end", "attrs")
+
+    def __init__(self, name: str, start: float, end: float, attrs: Dict[str, Any]):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.attrs = attrs
+
+
+class TraceCallback(BaseCallbackHandler):
+    """把图节点、模型请求和工具调用记录到所属的 Trace 中"""
+    run_inline = True
+
+    def __init__(self, trace: "Trace"):
+        self.trace = trace
+        # run_id -> (开始时间, span 名称, 属性)
+        self._runs: Dict[UUID, Tuple[float, str, Dict[str, Any]]] = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, metadata: Optional[Dict[str, Any]] = None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node and kwargs.get("name") == node and not node.startswith("__"):
+            self._runs[run_id] = (time.perf_counter(), f"node.{node}", {})
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id: UUID, **kwargs):
+        self._finish(run_id, error=type(error).__name__)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata: Optional[Dict[str, Any]] = None, **kwargs):
+        model = (metadata or {}).get("ls_model_name")
+        self._runs[run_id] = (time.perf_counter(), "llm", {"model": model, "messages": sum(len(m) for m in messages)})
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        attrs = {}
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    attrs["input_tokens"] = usage.get("input_tokens")
+                    attrs["output_tokens"] = usage.get("output_tokens")
+        self._finish(run_id, **attrs)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        self._finish(run_id, error=type(error).__name__)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name")
+        self._runs[run_id] = (time.perf_counter(), f"tool.{name}", {})
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error, *, run_id: UUID, **kwargs):
+        self._finish(run_id, error=type(error).__name__)
+
+    def _finish(self, run_id: UUID, **extra):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            started, name, attrs = run
+            attrs.update(extra)
+            self.trace.add(name, started, time.perf_counter(), **attrs)
+
+
+class Trace:
+    """一轮对话的追踪记录"""
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.spans: List[Span] = []
+        self.callback = TraceCallback(self)
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def add(self, name: str, start: float, end: float, **attrs):
+        # 回合结束后仍在运行的后台任务（如对话总结）不再记录
+        if self.end is None:
+            self.spans.append(Span(name, start, end, attrs))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "started_at": self.started_at.isoformat(timespec="milliseconds"),
+            "duration_ms": round(self.duration * 1000, 2),
+            **self.attrs,
+            "spans": [
+                {
+                    "name": span.name,
+                    "start_ms": round((span.start - self.start) * 1000, 2),
+                    "duration_ms": round((span.end - span.start) * 1000, 2),
+                    **span.attrs,
+                }
+                for span in sorted(self.spans, key=lambda s: s.start)
+            ],
+        }
+
+
+# 当前协程所属的对话追踪，LangGraph 创建的子任务会继承
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+def current_callbacks() -> List[BaseCallbackHandler]:
+    """当前对话需要追踪时返回记录节点、模型和工具的回调"""
+    trace = _current_trace.get()
+    return [trace.callback] if trace is not None else []
+
+
+def record(name: str, start: float, end: Optional[float] = None, **attrs):
+    """向当前对话的追踪中添加一段耗时，不在追踪中时什么都不做"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, start, end if end is not None else time.perf_counter(), **attrs)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[None]:
+    """记录 with 块的耗时"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter(), **attrs)
+
+
+class Tracer:
+    """按比例采样对话追踪，输出慢对话的完整追踪，按需对接下来的若干轮对话做 cProfile
+
+    慢对话阈值大于0时每轮都会记录（只是追加几十个 span，开销在微秒级），
+    结束后按耗时和采样结果决定是否输出；两者都关闭时不记录，也不添加回调。
+    """
+    def __init__(self, sample_rate: float, slow_turn: float, profile_dir: str, keep: int = 100):
+        self.sample_rate = sample_rate
+        self.slow_turn = slow_turn
+        self.profile_dir = profile_dir
+        # 最近输出的追踪，供 /debug/traces 查看
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=keep)
+        self.profile_remaining = 0
+        self._profiling = False
+
+    def profile(self, turns: int):
+        """对接下来的 turns 轮对话做 cProfile，0 表示取消"""
+        self.profile_remaining = max(0, turns)
+
+    @asynccontextmanager
+    async def turn(self, name: str, **attrs) -> AsyncIterator[Optional[Trace]]:
+        """追踪一轮对话"""
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        trace = Trace(name, attrs) if sampled or self.slow_turn > 0 else None
+        token = _current_trace.set(trace) if trace is not None else None
+
+        # cProfile 对整个线程生效，同一时间只剖析一轮对话，期间并发的其他对话也会计入
+        profiler = None
+        if self.profile_remaining > 0 and not self._profiling:
+            self.profile_remaining -= 1
+            self._profiling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            yield trace
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                await asyncio.to_thread(self._save_profile, profiler, name)
+            if trace is not None:
+                _current_trace.reset(token)
+                trace.end = time.perf_counter()
+                slow = 0 < self.slow_turn <= trace.duration
+                if sampled or slow:
+                    self._emit(trace, slow)
+
+    def _emit(self, trace: Trace, slow: bool):
+        data = trace.to_dict()
+        data["slow"] = slow
+        self.recent.append(data)
+        text = orjson.dumps(data).decode()
+        if slow:
+            logger.warning(f"慢对话 {data['duration_ms']:.0f}ms: {text}")
+        else:
+            logger.info(f"对话追踪: {text}")
+
+    def _save_profile(self, profiler: cProfile.Profile, name: str):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.prof")
+        profiler.dump_stats(path)
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(15)
+        logger.info(f"已保存性能分析结果 {path}，剩余 {self.profile_remaining} 轮\n{output.getvalue()}")
+
+
+# 创建全局实例
+tracer = Tracer(config.tracing_sample_rate, config.tracing_slow_turn, config.tracing_profile_dir)
@@ -0,0 +1,59 @@
+"""基准测试公共工具
+
+在导入 app 之前设置最小化的环境变量，使基准测试不依赖 config.toml，
+并提供一个可配置延迟、不访问网络的假 LLM。
+"""
+import asyncio
+import os
+import sys
+import time
+from typing import Any, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ.setdefault("QWEATHER_KEY", "bench")
+os.environ.setdefault("BOT_ID", "10000")
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from app.stats import percentile as _percentile
+
+
+class FakeChatModel(BaseChatModel):
+    """固定延迟的假聊天模型
+
+    blocking=True 时在异步路径中同步睡眠，模拟在事件循环里同步调用 LLM 的旧行为。
+    """
+    latency: float = 0.2
+    blocking: bool = False
+    reply: str = "好的"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _result(self) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return self._result()
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.blocking:
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+        return self._result()
+
+    def bind_tools(self, tools, **kwargs: Any):
+        return self
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """计算百分位数（最近秩法）"""
+    return _percentile(sorted(values), pct)
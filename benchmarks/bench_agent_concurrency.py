@@ -0,0 +1,65 @@
+"""Agent 并发吞吐基准测试
+
+使用假 LLM（固定延迟）驱动 create_agent 构建的图，比较：
+  blocking: LLM 调用阻塞事件循环（旧的同步 invoke 行为）
+  async:    ainvoke + AsyncSqliteSaver（当前实现）
+在不同并发度下的每秒对话轮数。
+
+用法:
+    python -m benchmarks.bench_agent_concurrency --turns 64 --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks._common import FakeChatModel
+
+import aiosqlite
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from app.ai.ai_handler import create_agent
+from app.ai.limiter import LLMLimiter
+
+
+async def run_turns(agent, turns: int, concurrency: int, run: str) -> float:
+    """以给定并发度执行 turns 轮对话，返回耗时（秒）
+
+    每轮使用独立的 thread_id，避免历史累积触发总结节点。
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_turn(i: int):
+        async with semaphore:
+            await agent.ainvoke(
+                input={"messages": [HumanMessage(content=f"你好 {i}")], "today": "2024-01-01 00:00:00"},
+                config={"configurable": {"thread_id": f"{run}-{i}"}}
+            )
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_turn(i) for i in range(turns)))
+    return time.perf_counter() - start
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        async with aiosqlite.connect(os.path.join(tmp, "checkpoints.db")) as conn:
+            checkpointer = AsyncSqliteSaver(conn)
+            print(f"{'mode':<10}{'concurrency':>12}{'seconds':>10}{'turns/s':>10}")
+            for mode in ("blocking", "async"):
+                llm = FakeChatModel(latency=args.latency, blocking=mode == "blocking")
+                # 不使用全局限流器（默认最多8个并发请求），只测量 agent 本身的并发能力
+                limiter = LLMLimiter(max_concurrency=max(args.concurrency), rpm=0, tpm=0, max_attempts=1, max_wait=0)
+                agent = create_agent(checkpointer, llm=llm, tools=[], debug=False, limiter=limiter)
+                for concurrency in args.concurrency:
+                    elapsed = await run_turns(agent, args.turns, concurrency, f"{mode}-{concurrency}")
+                    print(f"{mode:<10}{concurrency:>12}{elapsed:>10.2f}{args.turns / elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=64, help="每种配置执行的对话轮数")
+    parser.add_argument("--latency", type=float, default=0.2, help="假 LLM 每次调用的延迟（秒）")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64], help="并发度列表")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,68 @@
+"""聊天记录写入吞吐基准测试
+
+比较 add_chat_history 的两种写入方式（在临时数据库上）：
+  sync:     每条记录一个事务（旧行为）
+  buffered: ChatHistoryWriter 批量写入
+输出每秒写入行数，以及调用方（事件循环）上每次调用的平均耗时。
+
+用法:
+    python -m benchmarks.bench_chat_history --rows 5000 --batch-size 100
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks._common import ROOT  # noqa: F401  设置导入路径和环境变量
+
+# 数据库路径相对于工作目录，需在导入 app.sql 之前切换
+_workdir = tempfile.mkdtemp()
+os.makedirs(os.path.join(_workdir, ".data"))
+os.chdir(_workdir)
+
+from app.sql.chat_history import ChatHistoryWriter, add_chat_history
+import app.sql.chat_history as chat_history
+
+
+async def bench_sync(rows: int):
+    start = time.perf_counter()
+    for i in range(rows):
+        await add_chat_history(content=f"消息 {i}", user_id=i % 50, group_id=1)
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed
+
+
+async def bench_buffered(rows: int, batch_size: int, flush_interval: float):
+    writer = ChatHistoryWriter(batch_size=batch_size, flush_interval=flush_interval)
+    chat_history.history_writer = writer
+    writer.start()
+    start = time.perf_counter()
+    for i in range(rows):
+        await add_chat_history(content=f"消息 {i}", user_id=i % 50, group_id=1)
+        if i % batch_size == 0:
+            # 模拟事件循环上的其他工作，让后台刷新任务有机会运行
+            await asyncio.sleep(0)
+    enqueue_elapsed = time.perf_counter() - start
+    await writer.stop()
+    elapsed = time.perf_counter() - start
+    chat_history.history_writer = ChatHistoryWriter(batch_size=batch_size, flush_interval=flush_interval)
+    return elapsed, enqueue_elapsed
+
+
+def main(args):
+    print(f"{'mode':<10}{'rows':>8}{'seconds':>10}{'rows/s':>12}{'call(us)':>10}")
+    for mode in ("sync", "buffered"):
+        if mode == "sync":
+            elapsed, caller = asyncio.run(bench_sync(args.rows))
+        else:
+            elapsed, caller = asyncio.run(bench_buffered(args.rows, args.batch_size, args.flush_interval))
+        print(f"{mode:<10}{args.rows:>8}{elapsed:>10.2f}{args.rows / elapsed:>12.0f}{caller / args.rows * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000, help="写入的记录数")
+    parser.add_argument("--batch-size", type=int, default=100, help="缓冲写入的批大小")
+    parser.add_argument("--flush-interval", type=float, default=1.0, help="缓冲写入的刷新间隔（秒）")
+    main(parser.parse_args())
@@ -0,0 +1,112 @@
+"""OneBot 事件解析基准测试
+
+使用 benchmarks/data/onebot_events.jsonl 中的样例事件（群聊、私聊、心跳、通知、请求），比较：
+  legacy: json.loads + 按 post_type 分支 + model_validate，再分两次遍历消息段提取文本和@列表（旧实现）
+  orjson: orjson 解析 + 带标签联合类型的 TypeAdapter，一次遍历提取文本、@列表和指令标记
+  prefilter: orjson 解析后先用配置快照在原始字典上丢弃不需要处理的事件，只为剩余事件构建模型
+输出每种实现每秒解析的事件数。
+
+用法:
+    python -m benchmarks.bench_event_decode --events data/onebot_events.jsonl --repeat 2000
+"""
+import argparse
+import json
+import os
+import time
+from typing import List
+
+from benchmarks._common import ROOT
+
+from app.config import config
+from app.message_formatter import FormattedMessage
+from app.model import (
+    BasicMessage, GroupMessage, MessageReport, MetaEventReport, NoticeReport,
+    PrivateMessage, RequestReport, decode_event, validate_event,
+)
+from app.policy import get_policy
+import orjson
+
+
+def legacy_decode(data: bytes) -> BasicMessage:
+    data = json.loads(data.decode())
+    post_type = data.get('post_type')
+    message_type = data.get('message_type')
+    if post_type == 'message' and message_type == 'group':
+        return GroupMessage.model_validate(data)
+    elif post_type == 'message' and message_type == 'private':
+        return PrivateMessage.model_validate(data)
+    elif post_type == 'request':
+        return RequestReport.model_validate(data)
+    elif post_type == 'notice':
+        return NoticeReport.model_validate(data)
+    elif post_type == 'meta_event':
+        return MetaEventReport.model_validate(data)
+    return BasicMessage.model_validate(data)
+
+
+def legacy_format(message: MessageReport):
+    text_segments = []
+    for segment in message.message:
+        if segment.type == "text":
+            text_segments.append(segment.data["text"].strip())
+    content = " ".join(text_segments).strip()
+    at_list = []
+    for segment in message.message:
+        if segment.type == "at":
+            at_list.append(int(segment.data["qq"]))
+    return content, at_list, content.startswith(config.command_prefix)
+
+
+def run_legacy(events: List[bytes]):
+    for data in events:
+        message = legacy_decode(data)
+        if isinstance(message, MessageReport):
+            legacy_format(message)
+
+
+def run_orjson(events: List[bytes]):
+    for data in events:
+        message = decode_event(data)
+        if isinstance(message, MessageReport):
+            FormattedMessage(message)
+
+
+def run_prefilter(events: List[bytes]):
+    policy = get_policy()
+    for data in events:
+        event = orjson.loads(data)
+        if not policy.accepts(event):
+            continue
+        message = validate_event(event)
+        if isinstance(message, MessageReport):
+            FormattedMessage(message).should_reply()
+
+
+def main(args):
+    path = args.events if os.path.isabs(args.events) else os.path.join(ROOT, "benchmarks", args.events)
+    with open(path, "rb") as f:
+        sample = [line.strip() for line in f if line.strip()]
+    events = sample * args.repeat
+    print(f"样例事件 {len(sample)} 条，共解析 {len(events)} 条")
+
+    # 两种实现的解析结果应一致
+    for data in sample:
+        assert legacy_decode(data) == decode_event(data)
+
+    accepted = sum(get_policy().accepts(orjson.loads(data)) for data in sample)
+    print(f"按当前配置需要处理的事件 {accepted}/{len(sample)} 条")
+
+    print(f"{'impl':<10}{'events/s':>12}{'us/event':>10}")
+    for name, run in (("legacy", run_legacy), ("orjson", run_orjson), ("prefilter", run_prefilter)):
+        run(sample)  # 预热
+        start = time.perf_counter()
+        run(events)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<10}{len(events) / elapsed:>12.0f}{elapsed / len(events) * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", default="data/onebot_events.jsonl", help="每行一个 OneBot 事件的 JSONL 文件")
+    parser.add_argument("--repeat", type=int, default=2000, help="样例事件重复次数")
+    main(parser.parse_args())
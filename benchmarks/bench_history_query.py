@@ -0,0 +1,140 @@
+"""聊天记录查询基准测试
+
+在临时数据库中生成大量聊天记录，比较：
+  legacy: 单列索引 + ORDER BY created_at ASC LIMIT（旧实现）
+  latest: 复合索引上的 get_user_history / get_group_history（最近N条）
+  keyset: 使用游标连续向前翻页
+输出每种查询的平均耗时。
+
+用法:
+    python -m benchmarks.bench_history_query --rows 2000000 --groups 200 --users 5000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks._common import ROOT  # noqa: F401  设置导入路径和环境变量
+
+# 数据库路径相对于工作目录，需在导入 app.sql 之前切换
+_workdir = tempfile.mkdtemp()
+os.makedirs(os.path.join(_workdir, ".data"))
+os.chdir(_workdir)
+
+from sqlmodel import select
+from app.sql.client import db_client
+from app.sql.models import ChatHistory
+from app.sql.chat_history import get_group_history, get_user_history, history_cursor
+
+COMPOSITE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_chat_history_user_group_created ON chat_history (user_id, group_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_chat_history_group_created ON chat_history (group_id, created_at, id)",
+]
+LEGACY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_chat_history_user_id ON chat_history (user_id)",
+    "CREATE INDEX IF NOT EXISTS ix_chat_history_group_id ON chat_history (group_id)",
+]
+
+
+def populate(rows: int, groups: int, users: int):
+    """批量生成记录，每个用户固定属于一个群"""
+    conn = sqlite3.connect(db_client.path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    for name in ("ix_chat_history_user_group_created", "ix_chat_history_group_created"):
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    start = datetime(2024, 1, 1)
+    rng = random.Random(42)
+
+    def generate():
+        for i in range(rows):
+            user_id = rng.randrange(users)
+            # 与 SQLAlchemy 的存储格式保持一致（枚举存名称，时间带微秒）
+            created_at = (start + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S.%f")
+            yield (created_at, f"消息 {i}", user_id, user_id % groups, "HUMAN" if i % 2 else "AI", "MESSAGE")
+
+    conn.executemany(
+        "INSERT INTO chat_history (created_at, content, user_id, group_id, role, type) VALUES (?, ?, ?, ?, ?, ?)",
+        generate()
+    )
+    conn.commit()
+    conn.close()
+
+
+def execute(statements):
+    conn = sqlite3.connect(db_client.path)
+    for statement in statements:
+        conn.execute(statement)
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+def timed(func, repeat: int) -> float:
+    """返回平均耗时（毫秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def legacy_group_history(group_id: int, limit: int):
+    with db_client.get_session() as session:
+        query = select(ChatHistory).where(ChatHistory.group_id == group_id)
+        return session.exec(query.order_by(ChatHistory.created_at.asc()).limit(limit)).all()
+
+
+def legacy_user_history(user_id: int, group_id: int, limit: int):
+    with db_client.get_session() as session:
+        query = select(ChatHistory).where(ChatHistory.user_id == user_id, ChatHistory.group_id == group_id)
+        return session.exec(query.order_by(ChatHistory.created_at.asc()).limit(limit)).all()
+
+
+def keyset_pages(group_id: int, limit: int, pages: int):
+    page = get_group_history(group_id, limit=limit)
+    for _ in range(pages - 1):
+        if not page:
+            break
+        page = get_group_history(group_id, limit=limit, before=history_cursor(page[0]))
+
+
+def main(args):
+    t = time.perf_counter()
+    populate(args.rows, args.groups, args.users)
+    print(f"生成 {args.rows} 条记录耗时 {time.perf_counter() - t:.1f}s")
+
+    group_id = 7
+    user_id = group_id + args.groups  # 属于 group_id 的用户
+
+    execute(LEGACY_INDEXES)
+    db_client.engine.dispose()
+    results = [
+        ("legacy group", timed(lambda: legacy_group_history(group_id, args.limit), args.repeat)),
+        ("legacy user", timed(lambda: legacy_user_history(user_id, group_id, args.limit), args.repeat)),
+    ]
+
+    execute(["DROP INDEX ix_chat_history_user_id", "DROP INDEX ix_chat_history_group_id"] + COMPOSITE_INDEXES)
+    db_client.engine.dispose()
+    results += [
+        ("latest group", timed(lambda: get_group_history(group_id, limit=args.limit), args.repeat)),
+        ("latest user", timed(lambda: get_user_history(user_id, group_id, limit=args.limit), args.repeat)),
+        (f"keyset x{args.pages}", timed(lambda: keyset_pages(group_id, args.limit, args.pages), args.repeat) / args.pages),
+    ]
+
+    print(f"{'query':<16}{'ms/query':>10}")
+    for name, ms in results:
+        print(f"{name:<16}{ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2_000_000, help="生成的记录数")
+    parser.add_argument("--groups", type=int, default=200, help="群数量")
+    parser.add_argument("--users", type=int, default=5000, help="用户数量")
+    parser.add_argument("--limit", type=int, default=10, help="每页记录数")
+    parser.add_argument("--pages", type=int, default=20, help="keyset 连续翻页数")
+    parser.add_argument("--repeat", type=int, default=20, help="每种查询重复次数")
+    main(parser.parse_args())
@@ -0,0 +1,414 @@
+"""端到端回放压测
+
+在子进程中用临时 config.toml 启动 uvicorn 运行 main:app，并在本进程内启动三个本地替身服务：
+  OpenAI 兼容接口: 可配置首字延迟和逐字延迟，支持流式(SSE)和非流式；问题包含"天气"时先返回 get_weather 工具调用
+  OneBot HTTP API: send_group_msg / send_private_msg，记录收到回复的时间
+  和风天气: city/lookup、weather/now、weather/7d 返回固定数据
+然后按给定速率和并发度把样例事件回放到 /onebot。每条消息事件的文本末尾追加 "#序号"，
+替身模型在回复中带上该序号，据此把 OneBot 收到的回复对应到原始事件，统计端到端延迟。
+
+输出 /onebot 请求延迟和端到端延迟的 p50/p95/p99、吞吐量和错误率；
+--output 把结果追加为一行 JSON，便于比较修改 handler.py、ai_handler.py 前后的多次运行；
+--metrics 保存服务端 /metrics 的内容，查看各阶段的耗时分布。
+
+用法:
+    python -m benchmarks.bench_replay --events data/onebot_events.jsonl --count 400 --rate 20 --concurrency 32
+    python -m benchmarks.bench_replay --llm-latency 1.0 --token-delay 0.02 --stream --queue --label stream
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks._common import ROOT, percentile
+
+import orjson
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, web
+
+MARKER = re.compile(r"#(\d+)")
+CITIES = ("北京", "上海", "成都")
+# 重复回放时各轮使用不同的用户ID，模拟更多的会话
+USER_OFFSET = 1_000_000
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class StubServers:
+    """OpenAI、OneBot、和风天气的本地替身"""
+    def __init__(self, llm_latency: float, token_delay: float, onebot_latency: float):
+        self.llm_latency = llm_latency
+        self.token_delay = token_delay
+        self.onebot_latency = onebot_latency
+        # 序号 -> OneBot 收到回复的时间
+        self.replies: Dict[int, float] = {}
+        self.llm_calls = 0
+        self.onebot_calls = 0
+        self.weather_calls = 0
+        self.port = free_port()
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/send_group_msg", self.send_msg)
+        app.router.add_post("/send_private_msg", self.send_msg)
+        app.router.add_get("/geo/city/lookup", self.city_lookup)
+        app.router.add_get("/v7/weather/now", self.weather_now)
+        app.router.add_get("/v7/weather/7d", self.weather_7d)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def _reply(self, messages: List[Dict[str, Any]], tools: bool) -> Dict[str, Any]:
+        """根据对话生成回复，需要查天气时返回工具调用"""
+        question = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        if not isinstance(question, str):
+            question = json.dumps(question, ensure_ascii=False)
+        markers = " ".join(f"#{n}" for n in MARKER.findall(question))
+        city = next((c for c in CITIES if c in question), CITIES[0])
+        if tools and messages and messages[-1].get("role") == "user" and "天气" in question:
+            return {"tool_calls": [{
+                "id": f"call_{self.llm_calls}",
+                "type": "function",
+                "function": {"name": "get_weather", "arguments": json.dumps({"location": city}, ensure_ascii=False)},
+            }]}
+        if messages and messages[-1].get("role") == "tool":
+            return {"content": f"{city}今天晴，15到22度，适合出门。{markers}"}
+        return {"content": f"收到，这是一条用于压测的回复。{markers}"}
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.llm_calls += 1
+        reply = self._reply(body.get("messages", []), bool(body.get("tools")))
+        usage = {"prompt_tokens": 500, "completion_tokens": 20, "total_tokens": 520}
+        created = int(time.time())
+        await asyncio.sleep(self.llm_latency)
+
+        if not body.get("stream"):
+            message = {"role": "assistant", "content": reply.get("content")}
+            if "tool_calls" in reply:
+                message["tool_calls"] = reply["tool_calls"]
+            return web.json_response({
+                "id": f"chatcmpl-{self.llm_calls}", "object": "chat.completion", "created": created,
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": message,
+                             "finish_reason": "tool_calls" if "tool_calls" in reply else "stop"}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(delta: Dict[str, Any], finish_reason: Optional[str] = None, **extra):
+            chunk = {
+                "id": f"chatcmpl-{self.llm_calls}", "object": "chat.completion.chunk", "created": created,
+                "model": body.get("model"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra,
+            }
+            await response.write(b"data: " + orjson.dumps(chunk) + b"\n\n")
+
+        if "tool_calls" in reply:
+            call = reply["tool_calls"][0]
+            await send({"role": "assistant", "content": None, "tool_calls": [{"index": 0, **call}]})
+            await send({}, "tool_calls")
+        else:
+            content = reply["content"]
+            await send({"role": "assistant", "content": ""})
+            for i in range(0, len(content), 4):
+                await send({"content": content[i:i + 4]})
+                await asyncio.sleep(self.token_delay)
+            await send({}, "stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send({}, usage=usage)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def send_msg(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        received = time.perf_counter()
+        self.onebot_calls += 1
+        for segment in body.get("message", []):
+            if segment.get("type") == "text":
+                for n in MARKER.findall(segment["data"]["text"]):
+                    self.replies.setdefault(int(n), received)
+        await asyncio.sleep(self.onebot_latency)
+        return web.json_response({"status": "ok", "retcode": 0, "data": {"message_id": self.onebot_calls}})
+
+    async def city_lookup(self, request: web.Request) -> web.Response:
+        self.weather_calls += 1
+        return web.json_response({"code": "200", "location": [{"id": "101270101", "name": request.query.get("location")}]})
+
+    async def weather_now(self, request: web.Request) -> web.Response:
+        self.weather_calls += 1
+        return web.json_response({"code": "200", "now": {
+            "temp": "18", "text": "晴", "feelsLike": "17", "humidity": "60", "windDir": "东风", "windScale": "2",
+        }})
+
+    async def weather_7d(self, request: web.Request) -> web.Response:
+        self.weather_calls += 1
+        day = {
+            "tempMax": "22", "tempMin": "15", "textDay": "晴", "textNight": "多云", "uvIndex": "5",
+            "windDirDay": "东风", "windScaleDay": "1-3", "humidity": "60",
+        }
+        return web.json_response({"code": "200", "daily": [{"fxDate": f"2024-01-0{i + 1}", **day} for i in range(7)]})
+
+
+def build_events(sample: List[Dict[str, Any]], count: int, users: int) -> List[Dict[str, Any]]:
+    """循环样例事件生成 count 条事件，消息事件的文本末尾追加序号"""
+    events = []
+    for seq, event in zip(range(count), itertools.cycle(sample)):
+        event = json.loads(json.dumps(event))
+        event["time"] = int(time.time())
+        round_ = seq // len(sample)
+        if "user_id" in event and users > 1:
+            event["user_id"] += (round_ % users) * USER_OFFSET
+            if isinstance(event.get("sender"), dict):
+                event["sender"]["user_id"] = event["user_id"]
+        if event.get("post_type") == "message":
+            event["message_id"] = seq + 1
+            event["message"] = list(event.get("message", [])) + [{"type": "text", "data": {"text": f" #{seq}"}}]
+            event["raw_message"] = f"{event.get('raw_message', '')} #{seq}"
+        events.append(event)
+    return events
+
+
+def write_config(path: str, stub_url: str, events: List[Dict[str, Any]], args) -> None:
+    """生成压测用的 config.toml，事件中出现的群都配置为只响应@消息"""
+    bot_id = next((e["self_id"] for e in events if "self_id" in e), 10000)
+    private_users = sorted({e["user_id"] for e in events if e.get("message_type") == "private"})
+    groups = sorted({e["group_id"] for e in events if e.get("group_id") is not None})
+    lines = [
+        "[api]",
+        'qweather_key = "bench"',
+        f'qweather_geo_url = "{stub_url}/geo"',
+        f'qweather_api_url = "{stub_url}/v7"',
+        "",
+        "[onebot]",
+        f'base_url = "{stub_url}"',
+        f"send_interval = {args.send_interval}",
+        "",
+        "[openai]",
+        'api_key = "bench"',
+        f'base_url = "{stub_url}/v1"',
+        'model = "bench-model"',
+        "",
+        "[llm]",
+        f"max_concurrency = {args.llm_concurrency}",
+        "",
+        "[queue]",
+        f"enabled = {str(args.queue).lower()}",
+        f"workers = {args.workers}",
+        "",
+        "[stream]",
+        f"enabled = {str(args.stream).lower()}",
+        "",
+        "[users]",
+        f"bot_id = {bot_id}",
+        "reload_interval = 0",
+        f"allowed_users = {private_users}",
+    ]
+    for group_id in groups:
+        lines += ["", "[[groups]]", f"id = {group_id}", "at_only = true"]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def expected_replies(cwd: str, events: List[Dict[str, Any]]) -> set:
+    """按生成的配置计算需要回复的事件序号"""
+    from app.config import load_config
+    from app.policy import PolicySnapshot
+
+    current = os.getcwd()
+    os.chdir(cwd)
+    try:
+        policy = PolicySnapshot(load_config())
+    finally:
+        os.chdir(current)
+    return {
+        seq for seq, event in enumerate(events)
+        if event.get("post_type") == "message" and policy.accepts(event)
+    }
+
+
+async def wait_ready(session: ClientSession, url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服务启动失败，退出码 {process.returncode}")
+        try:
+            async with session.get(f"{url}/queue/stats") as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("等待服务启动超时")
+
+
+async def replay(session: ClientSession, url: str, events: List[Dict[str, Any]], rate: float, concurrency: int):
+    """按速率发送事件，返回每条事件的 (发送时间, 请求耗时, 是否成功)"""
+    semaphore = asyncio.Semaphore(concurrency)
+    results: List[Optional[tuple]] = [None] * len(events)
+
+    async def post(seq: int, body: bytes):
+        try:
+            sent = time.perf_counter()
+            async with session.post(f"{url}/onebot", data=body, headers={"Content-Type": "application/json"}) as response:
+                await response.read()
+                ok = response.status == 200
+        except Exception:
+            ok = False
+        results[seq] = (sent, time.perf_counter() - sent, ok)
+        semaphore.release()
+
+    tasks = []
+    start = time.perf_counter()
+    for seq, event in enumerate(events):
+        if rate > 0:
+            delay = start + seq / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await semaphore.acquire()
+        tasks.append(asyncio.create_task(post(seq, orjson.dumps(event))))
+    await asyncio.gather(*tasks)
+    return results
+
+
+async def run(args) -> Dict[str, Any]:
+    path = args.events if os.path.isabs(args.events) else os.path.join(ROOT, "benchmarks", args.events)
+    with open(path, "rb") as f:
+        sample = [orjson.loads(line) for line in f if line.strip()]
+    events = build_events(sample, args.count, args.users)
+
+    stubs = StubServers(args.llm_latency, args.token_delay, args.onebot_latency)
+    await stubs.start()
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+
+    with tempfile.TemporaryDirectory() as cwd:
+        os.makedirs(os.path.join(cwd, ".data"))
+        write_config(os.path.join(cwd, "config.toml"), stubs.base_url, events, args)
+        expected = expected_replies(cwd, events)
+        log_path = os.path.join(cwd, "server.log")
+        env = {**os.environ, "PYTHONPATH": ROOT}
+        with open(log_path, "w") as log:
+            process = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                 "--log-level", "warning", "--no-access-log"],
+                cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT
+            )
+        try:
+            async with ClientSession(connector=TCPConnector(limit=0), timeout=ClientTimeout(total=args.timeout)) as session:
+                await wait_ready(session, url, process)
+                started = time.perf_counter()
+                results = await replay(session, url, events, args.rate, args.concurrency)
+
+                # 等待剩余的回复
+                deadline = time.perf_counter() + args.timeout
+                while not expected.issubset(stubs.replies) and time.perf_counter() < deadline:
+                    await asyncio.sleep(0.1)
+                finished = time.perf_counter()
+                if args.metrics:
+                    async with session.get(f"{url}/metrics") as response:
+                        with open(args.metrics, "w", encoding="utf-8") as f:
+                            f.write(await response.text())
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            with open(log_path, encoding="utf-8", errors="replace") as f:
+                server_log = f.read()
+            await stubs.stop()
+
+    http_latency = [r[1] for r in results if r and r[2]]
+    http_errors = sum(1 for r in results if not r or not r[2])
+    e2e = [stubs.replies[seq] - results[seq][0] for seq in expected if seq in stubs.replies and results[seq]]
+    missing = len(expected) - len(e2e)
+    last_reply = max((stubs.replies[seq] for seq in expected if seq in stubs.replies), default=finished)
+    server_errors = sum(1 for line in server_log.splitlines() if line.startswith("ERROR") or "Traceback" in line)
+    if args.show_log or server_errors:
+        print(server_log[-4000:], file=sys.stderr)
+
+    return {
+        "label": args.label,
+        "events": len(events),
+        "expected_replies": len(expected),
+        "replies": len(e2e),
+        "http_errors": http_errors,
+        "missing_replies": missing,
+        "error_rate": (http_errors + missing) / len(events) if events else 0.0,
+        "server_errors": server_errors,
+        "duration": last_reply - started,
+        "events_per_sec": len(events) / (max(r[0] for r in results if r) - started or 1e-9),
+        "replies_per_sec": len(e2e) / (last_reply - started) if e2e else 0.0,
+        "http_ms": {f"p{p}": percentile(http_latency, p) * 1000 for p in (50, 95, 99)},
+        "e2e_ms": {f"p{p}": percentile(e2e, p) * 1000 for p in (50, 95, 99)},
+        "llm_calls": stubs.llm_calls,
+        "onebot_calls": stubs.onebot_calls,
+        "weather_calls": stubs.weather_calls,
+    }
+
+
+def main(args):
+    result = asyncio.run(run(args))
+    print(f"事件 {result['events']} 条，需要回复 {result['expected_replies']} 条，"
+          f"收到回复 {result['replies']} 条，耗时 {result['duration']:.2f}s")
+    print(f"发送速率 {result['events_per_sec']:.1f} events/s，回复吞吐 {result['replies_per_sec']:.1f} replies/s")
+    print(f"错误率 {result['error_rate']:.2%}（请求失败 {result['http_errors']}，未收到回复 {result['missing_replies']}，"
+          f"服务端错误日志 {result['server_errors']}）")
+    print(f"替身调用: LLM {result['llm_calls']}，OneBot {result['onebot_calls']}，天气 {result['weather_calls']}")
+    print(f"{'latency(ms)':<12}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, key in (("/onebot", "http_ms"), ("end-to-end", "e2e_ms")):
+        values = result[key]
+        print(f"{name:<12}{values['p50']:>10.1f}{values['p95']:>10.1f}{values['p99']:>10.1f}")
+
+    if args.output:
+        record = {**result, "args": {k: v for k, v in vars(args).items() if k != "output"}}
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", default="data/onebot_events.jsonl", help="每行一个 OneBot 事件的 JSONL 文件")
+    parser.add_argument("--count", type=int, default=200, help="回放的事件总数，样例不足时循环使用")
+    parser.add_argument("--rate", type=float, default=20, help="每秒发送的事件数，0表示只受并发度限制")
+    parser.add_argument("--concurrency", type=int, default=32, help="同时进行的 /onebot 请求数")
+    parser.add_argument("--users", type=int, default=1, help="循环回放时轮换的用户ID数量，用于模拟更多会话")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="替身模型的首字延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="替身模型流式输出时每4个字的间隔（秒）")
+    parser.add_argument("--onebot-latency", type=float, default=0.0, help="替身 OneBot 接口的响应延迟（秒）")
+    parser.add_argument("--send-interval", type=float, default=0, help="写入配置的 [onebot] send_interval")
+    parser.add_argument("--llm-concurrency", type=int, default=8, help="写入配置的 [llm] max_concurrency")
+    parser.add_argument("--queue", action="store_true", help="启用事件队列")
+    parser.add_argument("--workers", type=int, default=4, help="事件队列的 worker 数量")
+    parser.add_argument("--stream", action="store_true", help="启用群聊流式回复")
+    parser.add_argument("--timeout", type=float, default=60, help="单个请求以及等待剩余回复的超时（秒）")
+    parser.add_argument("--label", default="", help="本次运行的标签，写入 --output")
+    parser.add_argument("--output", help="把结果追加为一行 JSON 的文件")
+    parser.add_argument("--metrics", help="运行结束后把服务端 /metrics 的内容保存到该文件")
+    parser.add_argument("--show-log", action="store_true", help="输出服务端日志的末尾部分")
+    main(parser.parse_args())
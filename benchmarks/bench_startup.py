@@ -0,0 +1,68 @@
+"""冷启动导入耗时基准测试
+
+在独立子进程中多次执行 `import main`，统计冷导入耗时，
+可选输出 `-X importtime` 中累计耗时最高的模块。
+
+用法:
+    python -m benchmarks.bench_startup --runs 5 --top 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks._common import ROOT
+
+
+def import_once(cwd: str, env: dict, importtime: bool = False) -> subprocess.CompletedProcess:
+    args = [sys.executable]
+    if importtime:
+        args += ["-X", "importtime"]
+    args += ["-c", "import main"]
+    return subprocess.run(args, cwd=cwd, env=env, capture_output=True, text=True, timeout=120)
+
+
+def top_imports(stderr: str, top: int):
+    """解析 -X importtime 输出，返回累计耗时最高的模块"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # 格式: "import time:  self [us] | cumulative | imported package"
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(args):
+    env = {**os.environ, "PYTHONPATH": ROOT}
+    with tempfile.TemporaryDirectory() as cwd:
+        # 应用在工作目录下创建数据库
+        os.makedirs(os.path.join(cwd, ".data"))
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            result = import_once(cwd, env)
+            timings.append(time.perf_counter() - start)
+            if result.returncode != 0:
+                print(result.stderr, file=sys.stderr)
+                sys.exit(result.returncode)
+
+        print(f"runs={args.runs} median={statistics.median(timings):.3f}s "
+              f"min={min(timings):.3f}s max={max(timings):.3f}s")
+
+        if args.top:
+            result = import_once(cwd, env, importtime=True)
+            print(f"\n{'cumulative(ms)':>15}  module")
+            for cumulative_us, name in top_imports(result.stderr, args.top):
+                print(f"{cumulative_us / 1000:>15.1f}  {name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="冷启动次数")
+    parser.add_argument("--top", type=int, default=10, help="输出累计耗时最高的模块数，0表示不输出")
+    main(parser.parse_args())
@@ -1,26 +1,29 @@
+import asyncio
+import hmac
 import uvicorn
 from app.logger import LOGGING_CONFIG
 from app.bot_client import bot_client
-from fastapi import FastAPI, Request
+import time
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi.concurrency import asynccontextmanager
-from app.model import (
-    BasicMessage, 
-    GroupMessage, 
-    PrivateMessage, 
-    RequestReport, 
-    NoticeReport, 
-    MetaEventReport
-)
-from app.handler import (
-    handle_private_message,
-    handle_group_message,
-    handle_request,
-    handle_notice,
-    handle_meta_event
-)
+import orjson
+from app.model import validate_event
+from app.policy import get_policy, policy_watcher
+from app.handler import dispatch_event, ai_handler
 import logging
 from app.ai.tools.timer_tool_provider import timer_service
+from app.ai.tools.weather_tool_provider import weather_service
+from app.config import config
+from app.conversation_scheduler import conversation_scheduler
+from app.event_queue import event_queue
+from app.coalescer import message_coalescer
+from app.ai.router import llm_router
+from app.ai.limiter import llm_limiter
 from app.sql.client import db_client
+from app.sql.chat_history import history_writer
+from app.sql.archive import history_archiver
+from app import metrics
+from app.tracing import tracer
 
 logger = logging.getLogger("uvicorn")
 
@@ -29,8 +32,27 @@ logger = logging.getLogger("uvicorn")
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     timer_service.start()
+    policy_watcher.start()
+    # 保存引用，避免初始化任务在完成前被回收
+    app.state.warm_up = ai_handler.warm_up()
+    if config.history_durability == "buffered":
+        history_writer.start()
+    if config.archive_enabled:
+        history_archiver.start()
+    if config.queue_enabled:
+        event_queue.start(dispatch_event)
     yield
-    timer_service.shutdown()
+    await event_queue.stop()
+    await message_coalescer.close()
+    await history_writer.stop()
+    await history_archiver.stop()
+    await timer_service.shutdown()
+    await policy_watcher.stop()
+    if not app.state.warm_up.done():
+        app.state.warm_up.cancel()
+    await asyncio.gather(app.state.warm_up, return_exceptions=True)
+    await ai_handler.close()
+    await weather_service.close()
     await bot_client.close()
     db_client.close()
 
@@ -38,23 +60,71 @@ app = FastAPI(lifespan=lifespan)
 
 @app.post("/onebot")
 async def onebotapi(request: Request):
-    data = await request.body()
-    message = BasicMessage.model_validate_json(data)
-    match message:
-        case GroupMessage() as group_message:
-            await handle_group_message(group_message)
-        case PrivateMessage() as private_message:
-            await handle_private_message(private_message)
-        case RequestReport() as request_report:
-            handle_request(request_report)
-        case NoticeReport() as notice_report:
-            handle_notice(notice_report)
-        case MetaEventReport() as meta_event_report:
-            handle_meta_event(meta_event_report)
-        case _:
-            logger.warning(f"未知事件类型: {message}")
+    body = await request.body()
+    started = time.perf_counter()
+    data = orjson.loads(body)
+    decoded = time.perf_counter()
+    post_type = str(data.get("post_type"))
+    group_id = data.get("group_id")
+    # 心跳、好友请求等不属于任何会话的事件标记为 none
+    group = metrics.group_label(group_id) if group_id is not None or post_type == "message" else "none"
+    # 不需要处理的事件不构建模型
+    accepted = get_policy().accepts(data)
+    filtered = time.perf_counter()
+    metrics.EVENT_FILTER_SECONDS.observe(filtered - decoded, group)
+    metrics.EVENTS_TOTAL.inc(post_type, group, "accepted" if accepted else "dropped")
+    if not accepted:
+        metrics.EVENT_DECODE_SECONDS.observe(decoded - started, post_type)
+        return {}
+    message = validate_event(data)
+    metrics.EVENT_DECODE_SECONDS.observe(decoded - started + time.perf_counter() - filtered, post_type)
+    if event_queue.running:
+        # 入队后立即返回，避免 OneBot 端等待超时重试
+        if not await event_queue.put(message):
+            raise HTTPException(status_code=503, detail="事件队列已满")
+        return {}
+    await dispatch_event(message)
     return {}
 
+@app.get("/queue/stats")
+async def queue_stats():
+    """事件队列统计"""
+    return {
+        "enabled": event_queue.running,
+        "size": event_queue.queue.qsize(),
+        "active_conversations": conversation_scheduler.active,
+        **event_queue.stats.snapshot()
+    }
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """模型路由统计"""
+    return {**llm_router.snapshot(), "limiter": llm_limiter.snapshot()}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus 格式的指标"""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+def require_debug_token(request: Request):
+    """调试接口需要在请求头中携带 Authorization: Bearer <debug_token>，未配置 debug_token 时不开放"""
+    if not config.tracing_debug_token:
+        raise HTTPException(status_code=404)
+    authorization = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(authorization.encode(), f"Bearer {config.tracing_debug_token}".encode()):
+        raise HTTPException(status_code=401, detail="无效的调试令牌")
+
+@app.get("/debug/traces", dependencies=[Depends(require_debug_token)])
+async def debug_traces():
+    """最近输出的对话追踪（采样的和慢对话）"""
+    return {"profile_remaining": tracer.profile_remaining, "traces": list(tracer.recent)}
+
+@app.post("/debug/profile", dependencies=[Depends(require_debug_token)])
+async def debug_profile(turns: int = 1):
+    """对接下来的 turns 轮对话做 cProfile，0 表示取消"""
+    tracer.profile(turns)
+    return {"profile_remaining": tracer.profile_remaining, "profile_dir": config.tracing_profile_dir}
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app", 
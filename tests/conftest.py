@@ -0,0 +1,11 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# 测试不依赖 config.toml，必填配置使用环境变量
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("QWEATHER_KEY", "test")
+os.environ.setdefault("BOT_ID", "10000")
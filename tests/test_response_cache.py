@@ -0,0 +1,36 @@
+import asyncio
+from app.ai.response_cache import ResponseCache
+
+
+def weather_call(location: str):
+    return {"name": "get_weather", "args": {"location": location}, "id": "call", "type": "tool_call"}
+
+
+def new_cache() -> ResponseCache:
+    return ResponseCache(maxsize=16, ttl=600, cacheable_tools=["get_weather"])
+
+
+def test_self_contained_question_is_shared():
+    cache = new_cache()
+    # 会话A：问题中包含工具参数
+    asyncio.run(cache.put("成都天气怎么样", "成都今天晴", [weather_call("成都")]))
+    # 会话B：相同的问题命中缓存
+    assert asyncio.run(cache.get("成都天气怎么样？")) == "成都今天晴"
+
+
+def test_follow_up_is_not_shared():
+    cache = new_cache()
+    # 会话A：追问中的城市来自上文，不在问题中
+    asyncio.run(cache.put("那明天呢", "成都明天多云", [weather_call("成都")]))
+    # 会话A：没有调用工具的回复依赖上下文
+    asyncio.run(cache.put("为什么", "因为冷空气南下", []))
+    # 会话B：同样的追问不会拿到会话A的回答
+    assert asyncio.run(cache.get("那明天呢")) is None
+    assert asyncio.run(cache.get("为什么")) is None
+
+
+def test_other_tools_are_not_cached():
+    cache = new_cache()
+    call = {"name": "set_timer", "args": {"content": "开会"}, "id": "call", "type": "tool_call"}
+    asyncio.run(cache.put("开会", "好的", [call]))
+    assert asyncio.run(cache.get("开会")) is None